@@ -1,9 +1,11 @@
+import os
 from flask import Flask
 from config import config, FlaskConfig
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
-from flask_caching import Cache
+from app.caching import KeyCache, LRUCache, cache_config, sqlite_cache_config
+from app.serialization import payloads
 
 app = Flask(__name__)
 app.config.from_object(FlaskConfig)
@@ -14,27 +16,16 @@ login = LoginManager(app)
 login.login_view = 'login'
 
 
-class KeyCache(Cache):
-    def memoize(self, *args, **kwargs):
-        def decorator(f):
-            cached = super(KeyCache, self).memoize(*args, **kwargs)(f)
-
-            def set_cache(value, *sargs, **skwargs):
-                self.cache.set(cached.make_cache_key(cached.uncached, *sargs, **skwargs), value, timeout=cached.cache_timeout)
-            cached.set_cache = set_cache
-
-            def del_cache(*dargs, **dkwargs):
-                self.cache.delete(cached.make_cache_key(cached.uncached, *dargs, **dkwargs))
-            cached.del_cache = del_cache
-
-            return cached
-        return decorator
-
-
-cache = KeyCache(app, config={'CACHE_TYPE': 'simple', 'CACHE_THRESHOLD': 5000, 'CACHE_DEFAULT_TIMEOUT': 86400})
+cache = KeyCache(app, config=cache_config('yotter:', {'CACHE_TYPE': 'simple', 'CACHE_THRESHOLD': 5000, 'CACHE_DEFAULT_TIMEOUT': 86400}), serializer=payloads,
+                 l1=LRUCache('cache', config.l1_cache_mb * 2**20, config.l1_cache_ttl))
 
 # os.makedirs(config.cache_dir)
-fscache = KeyCache(app, config={'CACHE_TYPE': 'filesystem', 'CACHE_DIR': config.cache_dir, 'CACHE_THRESHOLD': 10000, 'CACHE_DEFAULT_TIMEOUT': 86400})
+fscache = KeyCache(app, config=cache_config('yotter-fs:', dict(sqlite_cache_config(), CACHE_KEY_PREFIX='yotter-fs:', CACHE_DEFAULT_TIMEOUT=86400)), serializer=payloads,
+                   l1=LRUCache('fscache', config.l1_cache_mb * 2**20, config.l1_cache_ttl))
+
+# comment pages are big and rarely read twice, so they get their own budget (and file) rather than evicting everything else
+commentcache = KeyCache(app, config=dict(sqlite_cache_config(os.path.join(config.cache_dir, 'comments.sqlite'), config.comment_cache_mb),
+                                         CACHE_KEY_PREFIX='yotter-comments:', CACHE_DEFAULT_TIMEOUT=config.comment_cache_ttl), serializer=payloads)
 
 
 from app import routes, models, errors
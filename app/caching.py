@@ -0,0 +1,403 @@
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from functools import wraps
+from flask_caching import Cache, function_namespace
+from app.metrics import metrics, timed
+from app.serialization import register_tuple
+from app.tasks import submit
+from config import config
+
+
+Stamped = register_tuple(namedtuple('Stamped', 'stored_at value timeout', defaults=(None,)))
+FLIGHT_TIMEOUT = 30  # max seconds to wait for someone else's fetch of the same key
+CACHE_VERSION = 2  # bump when the format of memoized values changes: entries of other versions are never read again
+
+
+class KeyCache(Cache):
+    '''Memoized functions get `set_cache` / `del_cache` to set or invalidate the entry for given args.
+    With a `soft_timeout` (stale-while-revalidate) an entry older than that is still served, while a single background refresh
+    is scheduled; once `timeout` (the hard ttl) has passed the entry is gone and the next call blocks on the function as usual.
+    Misses are single-flight: concurrent callers for the same key wait for one fetch, within the process and, with a backend
+    shared between processes, across processes through a lock entry in the cache itself.
+    A memoized function can return a value with a `cache_timeout` attribute (see `expiring`) to have it cached for that long instead.
+    With a `serializer` (eg `serialization.payloads`), memoized values are stored in its encoding rather than pickled as is.
+    Lookups, upstream calls (with their latency) and writes of memoized functions are recorded in `metrics`, by qualname.
+    Keys are namespaced by `CACHE_VERSION` and qualname (eg `ytVideo._get_page`), and each memoized function gets `purge` to
+    invalidate all its entries, or those of given instances, in every process (through flask-caching's version hashes) without
+    touching the rest of the cache. Memoized functions are listed in `memoized` by qualname.
+    With an `l1` (an `LRUCache`), memoized entries are also kept decoded in this process: lookups try it first and promote what
+    they find in the cache backend (the L2), writes go to both. The version hashes embedded in keys are kept in the L1 as well,
+    so an L1 hit costs no backend round trip; `purge` and `del_cache` (which resets the instance's version hash) invalidate
+    L1 copies at once in this process, and within the L1 ttl in the others. The L1 is only used in front of a backend shared
+    between processes: a local (`simple`) backend already is in-process.'''
+    def __init__(self, *args, serializer=None, l1=None, **kwargs):
+        super(KeyCache, self).__init__(*args, **kwargs)
+        self.shared = (kwargs.get('config') or {}).get('CACHE_TYPE') not in ('simple', 'null')  # between processes
+        self.serializer, self.l1 = serializer, l1 if self.shared else None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.memoized = {}
+
+    def _dump(self, entry):
+        return entry if self.serializer is None else self.serializer.dumps(entry)
+
+    def _load(self, raw):
+        if self.serializer is None or not isinstance(raw, bytes): return raw  # unserialized, or cached before serialization
+        return self.serializer.loads(raw)
+
+    def set_value(self, key, value, timeout=None):
+        '''Like `set`, through the serializer.'''
+        return self.cache.set(key, self._dump(value), timeout=timeout)
+
+    def get_value(self, key):
+        '''Like `get`, through the serializer.'''
+        raw = self.cache.get(key)
+        return None if raw is None else self._load(raw)
+
+    def get_values(self, *keys):
+        '''Like `get_many`, through the serializer.'''
+        return [None if raw is None else self._load(raw) for raw in self.cache.get_many(*keys)]
+
+    def clear(self):
+        if self.l1: self.l1.clear()
+        return super(KeyCache, self).clear()
+
+    def _l1_put(self, key, entry, raw, timeout):
+        if not self.l1 or not isinstance(entry, Stamped): return
+        expires = entry.stored_at + (entry.timeout or timeout or self.l1.ttl)
+        self.l1.set(key, entry, len(raw) if isinstance(raw, bytes) else _estimate_size(entry.value), min(expires, time.time() + self.l1.ttl))
+
+    def _memoize_version(self, f, args=None, kwargs=None, reset=False, delete=False, **options):
+        '''flask-caching's version hashes of `f` (and of the instance in `args`), through the L1'''
+        if not self.l1: return super(KeyCache, self)._memoize_version(f, args=args, kwargs=kwargs, reset=reset, delete=delete, **options)
+        fname, instance_fname = function_namespace(f, args=args)
+        key = f'$version:{fname}:{instance_fname or ""}'
+        if reset or delete or options.get('forced_update'):
+            if instance_fname: self.l1.delete(key)
+            else: self.l1.delete_prefix(f'$version:{fname}:')  # the function's hash is part of all its instances' versions
+            return super(KeyCache, self)._memoize_version(f, args=args, kwargs=kwargs, reset=reset, delete=delete, **options)
+        version = self.l1.get(key)
+        if version is None:
+            version = super(KeyCache, self)._memoize_version(f, args=args, kwargs=kwargs, **options)
+            self.l1.set(key, version, sys.getsizeof(version[1]), time.time() + self.l1.ttl)
+        return version
+
+    def _lookup(self, key, timeout):
+        '''a memoized entry, from the L1 or else the cache backend (then promoted to the L1)'''
+        entry = self.l1.get(key) if self.l1 else None
+        if entry is not None: return entry
+        raw = self.cache.get(key)
+        if raw is None: return None
+        entry = self._load(raw)
+        self._l1_put(key, entry, raw, timeout)
+        return entry
+
+    def _store(self, key, entry, timeout, name):
+        '''write a memoized entry through to the L1 and the cache backend'''
+        raw = self._dump(entry)
+        metrics.incr(name, 'sets')
+        if isinstance(raw, bytes): metrics.incr(name, 'bytes', len(raw))
+        self._l1_put(key, entry, raw, timeout)
+        return self.cache.set(key, raw, timeout=timeout)
+
+    def purge_memoized(self, name, *instances):
+        '''`purge` the memoized function `name` (a qualname), or all those of class `name`; returns how many were purged'''
+        purged = [m for fname, m in self.memoized.items() if fname == name or fname.startswith(f'{name}.')]
+        for memoized in purged: memoized.purge(*instances)
+        return len(purged)
+
+    def _fetch(self, key, f, args, kwargs, timeout):
+        '''Call `f` and cache its result, unless someone else is already doing that for `key`: then wait for their result.'''
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader: flight = self._flights[key] = Future()
+        if not leader:
+            try: return flight.result(timeout=FLIGHT_TIMEOUT)
+            except FutureTimeout: return f(*args, **kwargs)
+        try:
+            value = self._fetch_shared(key, f, args, kwargs, timeout)
+            flight.set_result(value)
+            return value
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._flights_lock: self._flights.pop(key, None)
+
+    def _fetch_shared(self, key, f, args, kwargs, timeout):
+        lock_key = f'{key}.lock'
+        deadline, delay = time.time() + FLIGHT_TIMEOUT, 0.05
+        while True:
+            if not self.shared or self.cache.add(lock_key, 1, timeout=FLIGHT_TIMEOUT):
+                try:
+                    value = f(*args, **kwargs)
+                    self._store(key, value, value.timeout or timeout, f.__qualname__)
+                    return value
+                finally:
+                    if self.shared: self.cache.delete(lock_key)
+            # another process is fetching it: poll for its result, until it stores one or gives up the lock (failed, or died)
+            while time.time() < deadline:
+                time.sleep(delay)
+                value = self._lookup(key, timeout)
+                if value is not None: return value
+                delay = min(delay * 2, 1)
+                if not self.cache.has(lock_key): break
+            else: return f(*args, **kwargs)
+
+    def memoize(self, timeout=None, *args, soft_timeout=None, **kwargs):
+        def decorator(f):
+            name, upstream = f.__qualname__, timed(f.__qualname__, f)
+            is_method = next(iter(inspect.signature(f).parameters), None) == 'self'
+
+            @wraps(f)
+            def stamped(*fargs, **fkwargs):
+                value = upstream(*fargs, **fkwargs)
+                return Stamped(time.time(), value, getattr(value, 'cache_timeout', None))
+            # only used for its cache keys, the lookup itself is done below
+            cached = super(KeyCache, self).memoize(timeout, *args, **kwargs)(stamped)
+
+            @wraps(f)
+            def memoized(*fargs, **fkwargs):
+                key = memoized.make_cache_key(*fargs, **fkwargs)
+                entry = self._lookup(key, memoized.cache_timeout)
+                metrics.incr(name, 'misses' if entry is None else 'hits')
+                if entry is None: entry = self._fetch(key, stamped, fargs, fkwargs, memoized.cache_timeout)
+                if not isinstance(entry, Stamped): return entry  # cached before values were stamped
+                if memoized.soft_timeout and time.time() - entry.stored_at > memoized.soft_timeout:
+                    metrics.incr(name, 'stale')
+                    refresh(key, fargs, fkwargs)
+                return entry.value
+            memoized.uncached = f
+            memoized.cache_timeout = cached.cache_timeout
+            memoized.soft_timeout = soft_timeout
+            memoized.make_cache_key = lambda *kargs, **kkwargs: f'v{CACHE_VERSION}:{name}:{cached.make_cache_key(stamped, *kargs, **kkwargs)}'
+            self.memoized[name] = memoized
+
+            def refresh(key, fargs, fkwargs):
+                with self._refresh_lock:
+                    if key in self._refreshing: return
+                    self._refreshing.add(key)
+
+                def run():
+                    try: self._fetch(key, stamped, fargs, fkwargs, memoized.cache_timeout)
+                    except Exception as e: print(f'.refresh {f.__qualname__}{fargs} failed: {e!r}')
+                    finally:
+                        with self._refresh_lock: self._refreshing.discard(key)
+                submit(run)
+
+            def set_cache(value, *sargs, **skwargs):
+                timeout = getattr(value, 'cache_timeout', None)
+                self._store(memoized.make_cache_key(*sargs, **skwargs), Stamped(time.time(), value, timeout), timeout or memoized.cache_timeout, name)
+            memoized.set_cache = set_cache
+
+            def del_cache(*dargs, **dkwargs):
+                key = memoized.make_cache_key(*dargs, **dkwargs)
+                self.cache.delete(key)
+                if self.l1:
+                    self.l1.delete(key)
+                    if is_method and dargs: purge(dargs[0])  # other processes may hold it in their L1
+            memoized.del_cache = del_cache
+
+            def purge(*instances):
+                '''invalidate every entry, or every entry of the given instances (for methods, whatever the other args)'''
+                if not instances: self._memoize_version(stamped, reset=True)
+                for obj in instances: self._memoize_version(stamped, args=(obj,), reset=True)
+            memoized.purge = purge
+
+            return memoized
+        return decorator
+
+
+class ExpiringDict(dict): pass
+class ExpiringList(list): pass
+
+
+def expiring(value, timeout):
+    '''`value` (a dict or a list), to be cached by memoized functions for `timeout` seconds rather than their default.'''
+    value = (ExpiringDict if isinstance(value, dict) else ExpiringList)(value)
+    value.cache_timeout = timeout
+    return value
+
+
+class PurgeStamps(object):
+    '''When the cached data of each kind (eg class) was last purged, in any process: objects holding on to data loaded before
+    that drop it. Stamps are read from `cache` at most every `interval` seconds per process.'''
+    def __init__(self, cache, prefix, interval):
+        self.cache, self.prefix, self.interval = cache, prefix, interval
+        self._seen = {}  # kind: (stamp, checked at)
+
+    def get(self, kind):
+        now = time.time()
+        stamp, checked = self._seen.get(kind, (0, 0))
+        if now - checked > self.interval:
+            stamp = self.cache.get_value(f'{self.prefix}:{kind}') or 0
+            self._seen[kind] = (stamp, now)
+        return stamp
+
+    def purged(self, kind):
+        now = time.time()
+        self.cache.set_value(f'{self.prefix}:{kind}', now, timeout=0)
+        self._seen[kind] = (now, now)
+
+
+class NegativeCache(object):
+    '''Remembers ids that failed upstream (eg deleted videos or channels), so they aren't fetched again for a while.
+    Each failure in a row doubles the ttl, from `base_ttl` up to `max_ttl`; failures are forgotten `max_ttl` after the last one.'''
+    def __init__(self, cache, prefix, base_ttl, max_ttl):
+        self.cache, self.prefix, self.base_ttl, self.max_ttl = cache, prefix, base_ttl, max_ttl
+
+    def _key(self, kind, id): return f'{self.prefix}:{kind}:{id}'
+
+    def get(self, kind, id):
+        '''the failure record for `id` if it's still to be avoided, else None'''
+        entry = self.cache.get_value(self._key(kind, id))
+        return entry if entry and entry['until'] > time.time() else None
+
+    def get_many(self, kind, ids):
+        '''{id: failure record} for all the ids that failed recently, whether they're still avoided or not'''
+        return {id: entry for id, entry in zip(ids, self.cache.get_values(*[self._key(kind, id) for id in ids])) if entry}
+
+    def failed(self, kind, id, error):
+        '''record a failure; returns the ttl until `id` should be retried'''
+        key, now = self._key(kind, id), time.time()
+        entry = self.cache.get_value(key) or {'failures': 0, 'first': now}
+        ttl = min(self.base_ttl * 2 ** entry['failures'], self.max_ttl)
+        entry.update(failures=entry['failures'] + 1, error=str(error), last=now, until=now + ttl)
+        self.cache.set_value(key, entry, timeout=ttl + self.max_ttl)
+        return ttl
+
+    def revived(self, kind, id):
+        '''forget the failures of `id` (a success); only costs a write if there were any'''
+        key = self._key(kind, id)
+        if self.cache.cache.get(key) is not None: self.cache.cache.delete(key)
+
+
+def sqlite_cache_config(path='', max_mb=None):
+    return {'CACHE_TYPE': 'app.sqlitecache.sqlite_cache', 'CACHE_SQLITE_PATH': path or os.path.join(config.cache_dir, 'cache.sqlite'),
+            'CACHE_MAX_BYTES': (max_mb or config.cache_max_mb) * 2**20}
+
+
+def cache_config(key_prefix, local):
+    '''flask-caching config for the `cache_backend` shared by all workers (and nodes) if one is configured, else `local`.
+    `cache_url` is the server url for redis (eg `redis://localhost:6379/0`), a comma separated list of servers for memcached,
+    or the database file for sqlite (shared by the processes on a host).'''
+    backend, url = config.cache_backend, config.cache_url
+    if not backend: return local
+    shared = {'CACHE_TYPE': backend, 'CACHE_KEY_PREFIX': key_prefix, 'CACHE_DEFAULT_TIMEOUT': local['CACHE_DEFAULT_TIMEOUT']}
+    if backend == 'sqlite': shared.update(sqlite_cache_config(url))
+    elif backend == 'redis': shared['CACHE_REDIS_URL'] = url
+    elif backend in ('memcached', 'saslmemcached'): shared['CACHE_MEMCACHED_SERVERS'] = url.split(',')
+    elif backend == 'filesystem': shared.update(CACHE_DIR=url or config.cache_dir, CACHE_THRESHOLD=local.get('CACHE_THRESHOLD', 10000))
+    else: raise ValueError(f"unsupported cache_backend '{backend}'")
+    return shared
+
+
+def _estimate_size(obj):
+    d = getattr(obj, '__dict__', {})
+    return sys.getsizeof(obj) + sys.getsizeof(d) + sum(sys.getsizeof(v) for v in d.values())
+
+
+class LRUCache(object):
+    '''In-process LRU of decoded entries, each with its own expiry (at most `ttl` seconds away), bounded by their total size.'''
+    def __init__(self, name, max_bytes, ttl):
+        self.name, self.max_bytes, self.ttl = name, max_bytes, ttl
+        self._entries, self._bytes = OrderedDict(), 0  # key: (expires, size, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def set(self, key, value, size, expires):
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old: self._bytes -= old[1]
+            self._entries[key] = (expires, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old: self._bytes -= old[1]
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]: self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {'name': self.name, 'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class IdentityMap(object):
+    '''In-process LRU map of live objects (never serialized), bounded by entry count and by the estimated size of the objects.
+    Exposes the `get` / `set` interface of a cache, for `unique_constructor`.'''
+    def __init__(self, name, max_entries, max_bytes):
+        self.name, self.max_entries, self.max_bytes = name, max_entries, max_bytes
+        self._objs, self._sizes, self._bytes = OrderedDict(), {}, 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def _account(self, key, obj):
+        size = _estimate_size(obj)  # objects grow as their props are fetched, so re-estimate on every access
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def get(self, key):
+        with self._lock:
+            obj = self._objs.get(key)
+            if obj is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._objs.move_to_end(key)
+            self._account(key, obj)
+            return obj
+
+    def set(self, key, obj):
+        with self._lock:
+            self._objs[key] = obj
+            self._objs.move_to_end(key)
+            self._account(key, obj)
+            while len(self._objs) > 1 and (len(self._objs) > self.max_entries or self._bytes > self.max_bytes):
+                old, _ = self._objs.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._objs.pop(key, None) is not None: self._bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._objs.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {'name': self.name, 'entries': len(self._objs), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
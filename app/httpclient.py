@@ -0,0 +1,79 @@
+import threading
+import urllib.parse
+from collections import Counter, defaultdict
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import config
+
+
+class CountingAdapter(HTTPAdapter):
+    '''HTTPAdapter counting requests and connections per host (connections through the pools' connection class), for `stats`.'''
+    def __init__(self, *args, **kwargs):
+        self.counts, self._lock = defaultdict(Counter), threading.Lock()  # host: {requests, waiting, opened, closed}
+        super(CountingAdapter, self).__init__(*args, **kwargs)
+
+    def count(self, host, what, n=1):
+        with self._lock: self.counts[host][what] += n
+
+    def snapshot(self):
+        with self._lock: return {host: dict(c) for host, c in self.counts.items()}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = {scheme: type(pool.__name__, (pool,), {'ConnectionCls': _counted(pool.ConnectionCls, self.count)})
+                                                   for scheme, pool in classes.items()}
+
+    def send(self, request, **kwargs):
+        host = urllib.parse.urlsplit(request.url).hostname
+        self.count(host, 'requests')
+        self.count(host, 'waiting')
+        try: return super(CountingAdapter, self).send(request, **kwargs)
+        finally: self.count(host, 'waiting', -1)
+
+
+def _counted(connection_class, count):
+    class CountedConnection(connection_class):
+        def connect(self):
+            super(CountedConnection, self).connect()
+            count(self.host, 'opened')
+
+        def close(self):
+            was_open = self.sock is not None
+            super(CountedConnection, self).close()
+            if was_open: count(self.host, 'closed')
+    return CountedConnection
+
+
+class Client(requests.Session):
+    '''Session with keep-alive connection pools shared by all threads, a default timeout and a retry policy.
+    At most `per_host` connections are kept per host; with `block`, requests beyond that wait for a free connection.
+    Being shared by all users' requests, it never keeps cookies.'''
+    def __init__(self, name, per_host, timeout, retries=2, block=False, hosts=100):
+        super(Client, self).__init__()
+        self.name, self.timeout, self.per_host = name, timeout, per_host
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # no domain is allowed to set cookies
+        retry = Retry(total=retries, connect=retries, read=0, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+        self.adapter = CountingAdapter(pool_connections=hosts, pool_maxsize=per_host, pool_block=block, max_retries=retry)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(Client, self).request(method, url, **kwargs)
+
+    def stats(self):
+        counts = self.adapter.snapshot()
+        return {'name': self.name, 'hosts': [{'host': host, 'connections': c.get('opened', 0) - c.get('closed', 0), 'opened': c.get('opened', 0),
+                                              'requests': c.get('requests', 0), 'waiting': c.get('waiting', 0), 'max': self.per_host}
+                                             for host, c in sorted(counts.items())]}
+
+
+# youtube pages, feeds and api calls: short requests, limited per host so a burst of misses can't flood youtube
+api = Client('api', config.http_api_per_host, timeout=(5, 20), block=True)
+# /stream and /ytimg: long lived, one connection per proxied stream; no retries, the client will ask again
+proxy = Client('proxy', config.http_proxy_per_host, timeout=(10, 60), retries=0)
+clients = (api, proxy)
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from app import httpclient
+from app.sqlitecache import ConnectionPool, PruneSchedule
+try:
+    from PIL import Image
+    try: import pillow_avif  # noqa: F401 - registers AVIF with older Pillow versions
+    except ImportError: pass
+    Image.init()
+except ImportError: Image = None
+try:
+    import gevent
+    from gevent.monkey import is_module_patched
+except ImportError: gevent = None
+
+ACCESS_RESOLUTION = 60  # only record accesses (for LRU) this many seconds apart
+PRUNE_EVERY = 100  # stores (by this process) between pruning passes
+MAX_IMAGE_BYTES = 5 * 2**20
+VARIANT_TIMEOUT = 30  # seconds to wait for a variant being made by another request, before serving the original
+
+IMAGE_WIDTHS = (160, 320, 480, 640)  # allowed resize targets, so the number of variants per image stays bounded
+# mimetype: (Pillow format, save options)
+IMAGE_FORMATS = {'image/avif': ('AVIF', {'quality': 50, 'speed': 8}), 'image/webp': ('WEBP', {'quality': 75, 'method': 4})}
+resizable = Image is not None
+transcodable = {mt for mt, (fmt, _) in IMAGE_FORMATS.items() if Image and fmt in Image.SAVE}
+
+CachedImage = namedtuple('CachedImage', 'key digest content_type etag last_modified size fetched accessed')
+
+
+def run_native(f, *args):
+    '''Run the CPU bound `f` in a native thread under gevent (Pillow releases the GIL, the event loop keeps serving), else inline.'''
+    if gevent is not None and is_module_patched('threading'): return gevent.get_hub().threadpool.apply(f, args)
+    return f(*args)
+
+
+def encode_variant(path, content_type, width, mimetype):
+    '''the image file at `path` resized to at most `width` and/or encoded as `mimetype`; returns (data, mimetype)'''
+    with Image.open(path) as im:
+        src_format = im.format
+        if width and im.width > width: im.thumbnail((width, im.height * width // im.width), Image.LANCZOS)
+        if not mimetype: mimetype = Image.MIME.get(src_format, content_type)
+        fmt, options = IMAGE_FORMATS.get(mimetype, (src_format, {'quality': 85} if src_format == 'JPEG' else {}))
+        if im.mode not in ('RGB', 'RGBA') or (fmt == 'JPEG' and im.mode != 'RGB'):
+            im = im.convert('RGBA' if fmt != 'JPEG' and 'transparency' in im.info else 'RGB')
+        out = io.BytesIO()
+        im.save(out, fmt, **options)
+    return out.getvalue(), mimetype
+
+
+class ImageFetchError(Exception):
+    def __init__(self, response):
+        super(ImageFetchError, self).__init__(f'{response.status_code} {response.url}')
+        self.response = response
+
+
+class ImageCache(object):
+    '''On-disk image cache. Files are content addressed (named by their sha256, so identical images are stored once), the index
+    maps keys (the upstream url, or a variant of it) to files along with the upstream validators, in an SQLite file shared by
+    all processes. Images are revalidated upstream every `revalidate` seconds, and least recently used ones are evicted
+    beyond `max_bytes`.'''
+    def __init__(self, path, max_bytes, revalidate):
+        self.path, self.max_bytes, self.revalidate = path, max_bytes, revalidate
+        os.makedirs(path, exist_ok=True)
+        self._pool, self._prunes = ConnectionPool(os.path.join(path, 'index.sqlite')), PruneSchedule(PRUNE_EVERY)
+        self._variants, self._variants_lock = {}, threading.Lock()  # variant key: Future, for those being made
+        with self._conn() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, digest TEXT, content_type TEXT, etag TEXT, '
+                         'last_modified TEXT, size INTEGER, fetched REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_images_accessed ON images (accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_images_digest ON images (digest)')
+
+    def _conn(self): return self._pool.connection()
+
+    def file(self, digest): return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key):
+        with self._conn() as conn:
+            row = conn.execute('SELECT * FROM images WHERE key = ?', (key,)).fetchone()
+            if row is None: return None
+            img = CachedImage(*row)
+            if not os.path.exists(self.file(img.digest)): return None  # evicted by another process meanwhile
+            now = time.time()
+            if img.accessed < now - ACCESS_RESOLUTION:
+                with conn: conn.execute('UPDATE images SET accessed = ? WHERE key = ?', (now, key))
+        return img
+
+    def put(self, key, data, content_type, etag=None, last_modified=None):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.file(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp, 'wb') as f: f.write(data)
+            os.replace(tmp, path)
+        now = time.time()
+        img = CachedImage(key, digest, content_type, etag, last_modified, len(data), now, now)
+        with self._conn() as conn, conn:
+            old = conn.execute('SELECT digest FROM images WHERE key = ?', (key,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)', img)
+            # the content changed upstream: drop the previous file unless another key still uses it
+            orphan = old and old[0] != digest and not conn.execute('SELECT 1 FROM images WHERE digest = ? LIMIT 1', old).fetchone()
+        if orphan:
+            try: os.remove(self.file(old[0]))
+            except FileNotFoundError: pass
+        if self._prunes.due(): self._prune()
+        return img
+
+    def fetch(self, url):
+        '''the cached image for `url`, fetched (or revalidated) upstream if missing (or due); raises ImageFetchError'''
+        img = self.get(url)
+        if img and time.time() - img.fetched < self.revalidate: return img
+        headers = {}
+        if img and img.etag: headers['If-None-Match'] = img.etag
+        if img and img.last_modified: headers['If-Modified-Since'] = img.last_modified
+        resp = httpclient.proxy.get(url, headers=headers)
+        if img and resp.status_code == 304:
+            with self._conn() as conn, conn: conn.execute('UPDATE images SET fetched = ? WHERE key = ?', (time.time(), url))
+            return img
+        if resp.status_code != 200 or len(resp.content) > MAX_IMAGE_BYTES:
+            if img: return img  # serve what we have
+            raise ImageFetchError(resp)
+        return self.put(url, resp.content, resp.headers.get('Content-Type', 'image/jpeg'), resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+
+    def variant(self, img, width=None, mimetype=None):
+        '''`img` resized to at most `width` and/or encoded as `mimetype` (one of `transcodable`), made once and cached; when that
+        wouldn't be smaller (or the image can't be decoded), the original is stored (once, being content addressed) for the variant.
+        Concurrent requests for the same variant wait for a single encoding.'''
+        key = f'{img.key}#{img.digest[:16]}:{width or ""}:{mimetype or ""}'  # a new original makes new variants, old ones age out
+        cached = self.get(key)
+        if cached: return cached
+        with self._variants_lock:
+            flight = self._variants.get(key)
+            leader = flight is None
+            if leader: flight = self._variants[key] = Future()
+        if not leader:
+            try: return flight.result(timeout=VARIANT_TIMEOUT)
+            except FutureTimeout: return img
+        try:
+            variant = self._make_variant(key, img, width, mimetype)
+            flight.set_result(variant)
+            return variant
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._variants_lock: self._variants.pop(key, None)
+
+    def _make_variant(self, key, img, width, mimetype):
+        try: data, mimetype = run_native(encode_variant, self.file(img.digest), img.content_type, width, mimetype)
+        except (Image.DecompressionBombError, OSError): data = None  # too large to decode, truncated, unknown format...
+        if data and len(data) < img.size: return self.put(key, data, mimetype)
+        with open(self.file(img.digest), 'rb') as f: return self.put(key, f.read(), img.content_type)
+
+    def _prune(self):
+        '''Evict the least recently used keys until the files still referenced fit in `max_bytes`, and delete orphaned files.'''
+        with self._conn() as conn, conn:
+            excess = (conn.execute('SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM images)').fetchone()[0] or 0) - self.max_bytes
+            if excess <= 0: return
+            refs, victims, orphans = dict(conn.execute('SELECT digest, COUNT(*) FROM images GROUP BY digest')), [], set()
+            for key, digest, size in conn.execute('SELECT key, digest, size FROM images ORDER BY accessed').fetchall():
+                if excess <= 0: break
+                victims.append((key,))
+                refs[digest] -= 1
+                if not refs[digest]:  # a file is only freed along with its last key
+                    orphans.add(digest)
+                    excess -= size
+            conn.executemany('DELETE FROM images WHERE key = ?', victims)
+        for digest in orphans:
+            try: os.remove(self.file(digest))
+            except FileNotFoundError: pass
+
+    def stats(self):
+        with self._conn() as conn:
+            keys, files, size = conn.execute('SELECT COUNT(*), COUNT(DISTINCT digest), '
+                                             '(SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM images)) FROM images').fetchone()
+        return {'entries': keys, 'files': files, 'bytes': size or 0, 'max_bytes': self.max_bytes}
@@ -0,0 +1,110 @@
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+COUNTERS = ('hits', 'misses', 'stale', 'calls', 'errors', 'sets', 'bytes')
+PUBLISH_INTERVAL = 10  # seconds between the publications of a process's metrics
+PUBLISH_TTL = 600  # processes that haven't published for this long are left out of the totals
+
+
+class Metrics(object):
+    '''Per fetcher counters (cache hits, misses, stale serves; upstream calls and errors; cache sets and bytes written)
+    and upstream latency histograms, for this process. Each process `publish`es its snapshot to a shared cache, where `gather`
+    sums those of all processes.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = self._published = time.time()
+        self._fetchers = defaultdict(self._new)
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+
+    @staticmethod
+    def _new(): return dict({c: 0 for c in COUNTERS}, seconds=0.0, histogram=[0] * len(BUCKETS))
+
+    def incr(self, name, counter, n=1):
+        with self._lock: self._fetchers[name][counter] += n
+
+    def observe(self, name, seconds, error=False):
+        '''record one upstream call'''
+        with self._lock:
+            m = self._fetchers[name]
+            m['calls'] += 1
+            m['errors'] += bool(error)
+            m['seconds'] += seconds
+            m['histogram'][next(i for i, b in enumerate(BUCKETS) if seconds <= b)] += 1
+
+    def snapshot(self):
+        with self._lock: fetchers = {name: dict(m, histogram=list(m['histogram'])) for name, m in self._fetchers.items()}
+        return _summarized({'since': self.started, 'workers': 1, 'buckets': [str(b) for b in BUCKETS], 'fetchers': fetchers})
+
+    def reset(self):
+        with self._lock: self._fetchers.clear()
+        self.started = time.time()
+
+    def publish(self, cache, force=False):
+        '''store this process's snapshot in `cache` (a `KeyCache` shared by the processes), at most every PUBLISH_INTERVAL seconds;
+        resets this process's metrics first if they were reset (`reset_all`) since they started'''
+        now = time.time()
+        if not force and now - self._published < PUBLISH_INTERVAL: return
+        self._published = now
+        if (cache.get_value('metrics:reset') or 0) > self.started: self.reset()
+        cache.set_value(f'metrics:{self.worker}', self.snapshot(), timeout=PUBLISH_TTL)
+        workers = cache.get_value('metrics:workers') or {}
+        workers = {w: t for w, t in workers.items() if t > now - PUBLISH_TTL}
+        if self.worker not in workers or now - workers[self.worker] > PUBLISH_TTL / 2:
+            workers[self.worker] = now
+            cache.set_value('metrics:workers', workers, timeout=PUBLISH_TTL)
+
+    def gather(self, cache):
+        '''the sum of the snapshots published to `cache` by the processes (this one's being up to date)'''
+        self.publish(cache, force=True)
+        reset = cache.get_value('metrics:reset') or 0
+        workers = sorted(cache.get_value('metrics:workers') or {})
+        snapshots = [s for s in cache.get_values(*[f'metrics:{w}' for w in workers]) if s and s['since'] >= reset]
+        fetchers = defaultdict(self._new)
+        for s in snapshots:
+            for name, m in s['fetchers'].items():
+                total = fetchers[name]
+                for c in COUNTERS + ('seconds',): total[c] += m[c]
+                total['histogram'] = [a + b for a, b in zip(total['histogram'], m['histogram'])]
+        return _summarized({'since': min((s['since'] for s in snapshots), default=self.started), 'workers': len(snapshots),
+                            'buckets': [str(b) for b in BUCKETS], 'fetchers': dict(fetchers)})
+
+    def reset_all(self, cache):
+        '''reset the metrics of every process (each one as it next publishes)'''
+        cache.set_value('metrics:reset', time.time(), timeout=0)
+        self.reset()
+        self.publish(cache, force=True)
+
+
+def _summarized(snapshot):
+    for m in snapshot['fetchers'].values():
+        lookups = m['hits'] + m['misses']
+        m['hit_ratio'] = m['hits'] / lookups if lookups else None
+        m['avg_seconds'] = m['seconds'] / m['calls'] if m['calls'] else None
+    return snapshot
+
+
+metrics = Metrics()
+
+
+def timed(name, f):
+    '''Call `f`, recording it as an upstream call of `name`.'''
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        start, error = time.time(), True
+        try:
+            result = f(*args, **kwargs)
+            error = False
+            return result
+        finally: metrics.observe(name, time.time() - start, error)
+    return wrapped
+
+
+def instrumented(f):
+    '''For upstream fetchers that aren't memoized (memoized ones are instrumented by KeyCache).'''
+    return timed(f.__qualname__, f)
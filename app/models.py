@@ -1,10 +1,14 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from app import db, login
 from flask_login import AnonymousUserMixin, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from importlib import import_module
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.ext.associationproxy import association_proxy
-from app.youtubeng import ytVideo, ytChannel, ytPlaylist
+from app.youtubeng import ytVideo, ytChannel, ytPlaylist, feed_listeners
 utcnow = datetime.utcnow
+EPOCH = datetime(1970, 1, 1)
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -16,9 +20,11 @@ class AnonymousUser(AnonymousUserMixin):
     yt_playlist_follows = frozenset()
     yt_followed_playlist_ids = frozenset()
     yt_followed_playlists = frozenset()
+    def prefetch_watched(self, vids): return
     def get_video_watched_progress(self, vid): return 0
     def set_video_watched_progress(self, vid, progress, duration): return
     def has_watched_video(self, vid): return False
+    def get_feed_videos(self, limit=50, max_days=365, before=None): return [], None
 
 
 login.anonymous_user = AnonymousUser
@@ -71,9 +77,22 @@ class User(UserMixin, db.Model):
                 res.append(ytVideo(db.db_video_watched.vid))
         return frozenset(res)
 
+    def prefetch_watched(self, vids):
+        '''Load the watch entries for `vids` in one batched query; lookups are then answered from a dict that lives as long as
+        this (per-request) user object.'''
+        index = self.__dict__.setdefault('_watched_index', {})
+        missing = list({vid for vid in vids if vid not in index})
+        for i in range(0, len(missing), 500):  # stay below sqlite's max bound parameters
+            chunk = missing[i:i + 500]
+            for vid in chunk: index[vid] = None
+            q = db.session.query(dbVideoWatched).join(dbVideoWatched.db_video).options(contains_eager(dbVideoWatched.db_video)) \
+                .filter(dbVideoWatched.user_rowid == self.rowid, dbVideo.id.in_(chunk))
+            for vw in q: index[vw.db_video.id] = vw
+
     def _get_vw(self, vid):
-        for w in self.yt_videos_watched:
-            if w.vid == vid: return w
+        index = self.__dict__.get('_watched_index')
+        if index is None or vid not in index: self.prefetch_watched([vid])
+        return self._watched_index[vid]
 
     def get_video_last_watched(self, vid):
         vw = self._get_vw(vid)
@@ -88,6 +107,7 @@ class User(UserMixin, db.Model):
         if not vw:
             vw = dbVideoWatched(user=self, vid=vid, duration=duration, watched_progress=progress)
             db.session.add(vw)
+            self._watched_index[vid] = vw
         else:
             vw.watched_progress = progress
             vw.duration = duration
@@ -95,13 +115,13 @@ class User(UserMixin, db.Model):
 
     def has_watched_video(self, vid):
         vw = self._get_vw(vid)
-        print(f'HAS {self} watched {vid}? ={vw}')
-        if vw:
-            print(dir(vw))
-            print(vw.duration)
-            print(vw.watched_progress)
         return (vw.duration or 99999) * 0.9 < vw.watched_progress if vw else False
 
+    def get_feed_videos(self, limit=50, max_days=365, before=None):
+        '''Returns a page of feed videos, and the cursor for the next (older) page or None (see `dbFeedEntry.latest_for_user`).'''
+        entries, cursor = dbFeedEntry.latest_for_user(self, limit, max_days, before)
+        return [e.to_video() for e in entries], cursor
+
 
 @login.user_loader
 def load_user(uid):
@@ -161,6 +181,7 @@ class dbChannel(dbBase, db.Model):
     is_blocked = db.Column(db.Boolean, default=False, index=True, nullable=True)
     user_subscriptions = db.relationship('dbChannelSubscription', collection_class=set, back_populates='db_channel', lazy=True)
     subscribers = association_proxy('user_subscriptions', 'user')
+    feed_entries = db.relationship('dbFeedEntry', back_populates='db_channel', lazy=True, cascade='all, delete-orphan')
     # followers = db.relationship('User', collection_class=set, secondary=user_channel_assoc, back_populates="db_followed_channels", lazy=True)
 
 
@@ -170,6 +191,7 @@ class dbPlaylist(dbBase, db.Model):
     # is_blocked = db.Column(db.Boolean, default=False, index=True, nullable=True)
     user_follows = db.relationship('dbPlaylistFollow', collection_class=set, back_populates='db_playlist', lazy=True)
     followers = association_proxy('user_follows', 'user')
+    feed_entries = db.relationship('dbFeedEntry', back_populates='db_playlist', lazy=True, cascade='all, delete-orphan')
 
 
 class dbVideo(dbBase, db.Model):
@@ -178,11 +200,107 @@ class dbVideo(dbBase, db.Model):
     user_watch_entries = db.relationship('dbVideoWatched', collection_class=set, back_populates='db_video', lazy=True)
     watchers = association_proxy('user_watch_entries', 'user')
 
+
+class dbFeedEntry(db.Model):
+    '''A video seen in a channel or playlist atom feed; entries are kept after they drop out of youtube's (15 items) feed.'''
+    __tablename__ = 'yt_feed_entry'
+    __table_args__ = (db.Index('ix_yt_feed_entry_channel_video', 'channel_rowid', 'video_id', unique=True),
+                      db.Index('ix_yt_feed_entry_playlist_video', 'playlist_rowid', 'video_id', unique=True))
+    rowid = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(64), index=True, nullable=False)
+    channel_rowid = db.Column(db.Integer, db.ForeignKey('yt_channel.rowid'), nullable=True)
+    playlist_rowid = db.Column(db.Integer, db.ForeignKey('yt_playlist.rowid'), nullable=True)
+    published = db.Column(db.DateTime(), index=True, nullable=False)
+    title = db.Column(db.String(256))
+    thumbnail = db.Column(db.String(256))
+    duration = db.Column(db.Integer, nullable=True)
+    view_count = db.Column(db.Integer, nullable=True)
+    cid = db.Column(db.String(64))
+    channel_name = db.Column(db.String(128))
+    db_channel = db.relationship('dbChannel', back_populates='feed_entries', lazy=True)
+    db_playlist = db.relationship('dbPlaylist', back_populates='feed_entries', lazy=True)
+
+    @classmethod
+    def merge(cls, src, videos):
+        '''Upsert the entries of a freshly fetched feed; only feeds of channels/playlists already in the db are materialized.
+        Runs in its own transaction: feeds are fetched in the middle of requests, whose session must not be committed here.'''
+        if not videos: return
+        dbcls, col = (dbChannel, 'channel_rowid') if isinstance(src, ytChannel) else (dbPlaylist, 'playlist_rowid')
+        table = cls.__table__
+        with db.engine.begin() as conn:
+            src_rowid = conn.execute(db.select(dbcls.rowid).where(dbcls.id == src.id)).scalar()
+            if src_rowid is None: return
+            rows = []
+            for v in videos:
+                duration = getattr(v, '_duration', None)
+                rows.append({col: src_rowid, 'video_id': v.id,
+                             'published': v.published.astimezone(timezone.utc).replace(tzinfo=None) if v.published.tzinfo else v.published,
+                             'title': v.title, 'thumbnail': v.thumbnail_unmapped, 'cid': v.cid, 'channel_name': v.channel_name,
+                             'view_count': int(v.view_count or 0), 'duration': duration if isinstance(duration, int) else None})
+            conn.execute(_upsert(conn, table, [col, 'video_id'], list(rows[0]), {'duration': lambda new: func.coalesce(new, table.c.duration)}), rows)
+
+    @classmethod
+    def latest_for_user(cls, user, limit=50, max_days=365, before=None):
+        '''The latest entries from `user`'s subscriptions and follows, excluding watched videos - a single indexed query.
+        `before` is the cursor returned for the previous page, if any, as parsed by `parse_cursor`; returns (entries, next cursor or None).'''
+        cids = db.session.query(dbChannelSubscription.channel_rowid).filter(dbChannelSubscription.user_rowid == user.rowid)
+        pids = db.session.query(dbPlaylistFollow.playlist_rowid).filter(dbPlaylistFollow.user_rowid == user.rowid)
+        # same criterion as User.has_watched_video
+        watched = db.session.query(dbVideo.id).join(dbVideoWatched, dbVideoWatched.video_rowid == dbVideo.rowid) \
+            .filter(dbVideoWatched.user_rowid == user.rowid, func.coalesce(func.nullif(dbVideo.duration, 0), 99999) * 0.9 < dbVideoWatched.watched_progress)
+        since = utcnow() - timedelta(days=max_days)
+        # one entry per video (the same video can come from both a channel and a playlist), picked before the limit
+        firsts = db.session.query(func.max(cls.rowid)) \
+            .filter(or_(cls.channel_rowid.in_(cids), cls.playlist_rowid.in_(pids)), ~cls.video_id.in_(watched), cls.published > since)
+        entries = cls.query.filter(cls.rowid.in_(firsts.group_by(cls.video_id)))
+        if before is not None:  # keyset on the page order: entries published at the same time are told apart by rowid
+            published, rowid = before
+            entries = entries.filter(or_(cls.published < published, and_(cls.published == published, cls.rowid < rowid)))
+        entries = entries.order_by(cls.published.desc(), cls.rowid.desc()).limit(limit).all()
+        return entries, entries[-1].cursor if len(entries) == limit else None
+
+    @property
+    def cursor(self):
+        '''the position of this entry in the feed order, for the `before` of the next page: "<published, in microseconds since the epoch>_<rowid>"'''
+        return f'{(self.published - EPOCH) // timedelta(microseconds=1)}_{self.rowid}'
+
+    @staticmethod
+    def parse_cursor(cursor):
+        '''(published, rowid) from a `cursor`; ValueError if it's not one'''
+        published, rowid = cursor.split('_')
+        return EPOCH + timedelta(microseconds=int(published)), int(rowid)
+
+    def to_video(self):
+        video = ytVideo(self.video_id)
+        video.addprop('title', self.title)
+        video.addprop('thumbnail', self.thumbnail)
+        video.addprop('cid', self.cid)
+        video.addprop('channel_name', self.channel_name)
+        video.addprop('published', self.published.replace(tzinfo=timezone.utc))
+        video.addprop('view_count', self.view_count)
+        if self.duration is not None: video.addprop('duration', self.duration)
+        return video
+
+def _upsert(conn, table, keys, columns, merge=None):
+    '''An INSERT that updates `columns` of the row already there for the unique `keys` instead, in the db's own dialect.
+    `merge` maps column names to functions of the new value, for the updates that aren't plain overwrites.'''
+    dialect = conn.dialect.name
+    if dialect not in ('sqlite', 'postgresql', 'mysql'): raise NotImplementedError(f'no upsert for {dialect}')
+    stmt = import_module(f'sqlalchemy.dialects.{dialect}').insert(table)
+    new = stmt.inserted if dialect == 'mysql' else stmt.excluded
+    merge = merge or {}
+    updates = {c: merge.get(c, lambda v: v)(new[c]) for c in columns if c not in keys}
+    if dialect == 'mysql': return stmt.on_duplicate_key_update(updates)
+    return stmt.on_conflict_do_update(index_elements=keys, set_=updates)
+
+
 def link_db(cls, dbcls):
     def dbget(self):
-        if hasattr(self, '_db_obj'): return getattr(self, '_db_obj')
-        obj = dbcls.load(self.id)
-        setattr(self, '_db_obj', obj)
+        # yt objects are shared (see IdentityMap) across requests and threads, so db objects are kept by each session (in its
+        # `info`) instead; that includes the transient ones `load` makes for ids not in the db, for setters to save that very one
+        objs = db.session.info.setdefault('yt_db_objs', {})
+        obj = objs.get((dbcls.__name__, self.id))
+        if obj is None: obj = objs[(dbcls.__name__, self.id)] = dbcls.load(self.id)
         return obj
     setattr(cls, 'db_obj', property(dbget, None, None, f'db-backed object'))
     # for prop in db.class_mapper(dbcls).column_attrs.keys():
@@ -203,3 +321,5 @@ link_db(ytChannel, dbChannel)
 link_db(ytPlaylist, dbPlaylist)
 link_db(ytVideo, dbVideo)
 
+feed_listeners.append(dbFeedEntry.merge)
+
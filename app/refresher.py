@@ -0,0 +1,94 @@
+import fcntl
+import heapq
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import User, dbChannel, dbChannelSubscription, dbPlaylist, dbPlaylistFollow, ytChannel, ytPlaylist
+from app.tasks import submit
+from config import config
+
+SYNC_INTERVAL = 60
+
+
+class FeedRefresher(threading.Thread):
+    '''Keeps the atom feed of every subscribed channel and followed playlist warm, so that /feed is (almost) always a cache hit.
+
+    Feeds are deduplicated across all (recently active) users and each one is refreshed after `feed_refresh_ratio` of its
+    cache timeout, i.e. before it expires. Newly seen feeds get a random offset within that period, so refreshes are spread out.
+    Only one process per host runs the refresher, guarded by a lock file in `temp_dir`.'''
+
+    def __init__(self, app):
+        super().__init__(name='yotter-feed-refresher', daemon=True)
+        self.app = app
+        self.schedule = []  # heap of (due, cls name, id)
+        self.wanted = set()  # (cls name, id)
+        self.scheduled = set()
+        self.inflight = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def period(cls): return cls._get_feed.cache_timeout * config.feed_refresh_ratio
+
+    def subscribed_ids(self):
+        since = datetime.utcnow() - timedelta(days=config.max_old_user_days)
+        cids = db.session.query(dbChannel.id).join(dbChannelSubscription, dbChannelSubscription.channel_rowid == dbChannel.rowid) \
+            .join(User, User.rowid == dbChannelSubscription.user_rowid).filter(User.last_seen > since).distinct()
+        pids = db.session.query(dbPlaylist.id).join(dbPlaylistFollow, dbPlaylistFollow.playlist_rowid == dbPlaylist.rowid) \
+            .join(User, User.rowid == dbPlaylistFollow.user_rowid).filter(User.last_seen > since).distinct()
+        return {('ytChannel', cid) for (cid,) in cids} | {('ytPlaylist', pid) for (pid,) in pids}
+
+    def sync(self):
+        self.wanted = self.subscribed_ids()
+        now = time.time()
+        for key in self.wanted - self.scheduled:
+            heapq.heappush(self.schedule, (now + random.uniform(0, self.period(CLASSES[key[0]])), *key))
+            self.scheduled.add(key)
+
+    def refresh(self, key):
+        cls, id = CLASSES[key[0]], key[1]
+        try:
+            obj = cls(id)
+            cls._get_feed.set_cache(cls._get_feed.uncached(obj), obj)
+        except Exception as e: print(f'.refresh {key} failed: {e!r}')
+        finally:
+            with self.lock: self.inflight.discard(key)
+
+    def run_due(self):
+        now = time.time()
+        while self.schedule and self.schedule[0][0] <= now:
+            _, *key = heapq.heappop(self.schedule)
+            key = tuple(key)
+            if key not in self.wanted:  # unsubscribed meanwhile
+                self.scheduled.discard(key)
+                continue
+            with self.lock:
+                if key not in self.inflight:
+                    self.inflight.add(key)
+                    submit(self.refresh, key)
+            heapq.heappush(self.schedule, (now + self.period(CLASSES[key[0]]), *key))
+
+    def acquire_host_lock(self):
+        self.lockfile = open(os.path.join(config.temp_dir, 'feed-refresher.lock'), 'w')
+        while True:
+            try: return fcntl.flock(self.lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError: time.sleep(SYNC_INTERVAL)  # another worker holds it; take over if it dies
+
+    def run(self):
+        self.acquire_host_lock()
+        next_sync = 0
+        while True:
+            with self.app.app_context():
+                if time.time() >= next_sync:
+                    try: self.sync()
+                    except Exception as e: print(f'.refresher sync failed: {e!r}')
+                    next_sync = time.time() + SYNC_INTERVAL
+                self.run_due()
+            next_due = self.schedule[0][0] if self.schedule else next_sync
+            time.sleep(max(0.1, min(next_due, next_sync) - time.time()))
+
+
+CLASSES = {'ytChannel': ytChannel, 'ytPlaylist': ytPlaylist}
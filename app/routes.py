@@ -1,21 +1,27 @@
 from datetime import datetime
+import hashlib
+import hmac
 import json
+import os
 import re
 import urllib
 from functools import wraps
-from operator import attrgetter
 
-import requests
 from flask import Response
-from flask import render_template, flash, redirect, url_for, request, send_from_directory, Markup
+from flask import render_template, flash, redirect, url_for, request, send_file, send_from_directory, Markup
 from flask_login import login_user, logout_user, current_user, login_required
 from werkzeug.datastructures import Headers
 from werkzeug.urls import url_parse
 
-from app import app, db, cache, fscache
+from app import app, db, cache, fscache, commentcache, httpclient
 from app.forms import LoginForm, RegistrationForm, EmptyForm, ChannelForm
-from app.models import User, dbChannel, dbPlaylist, ytChannel, ytPlaylist, ytVideo
-from app.youtubeng import prop_mappers, logged, yt_search
+from app.models import User, dbChannel, dbFeedEntry, dbChannelSubscription, dbPlaylist, dbPlaylistFollow, ytChannel, ytPlaylist, ytVideo
+from app.youtubeng import prop_mappers, logged, yt_search, prefetch, dead_ids, purges
+from app.refresher import FeedRefresher
+from app.metrics import metrics
+from app.tasks import submit
+from app.streamcache import StreamCache, StreamFetchError
+from app.imagecache import ImageCache, ImageFetchError, IMAGE_WIDTHS, resizable, transcodable
 
 from bleach import linkify as markup_linkify
 from bleach.sanitizer import Cleaner
@@ -36,7 +42,7 @@ def _fix_thumbnail_hq(url): return url.replace('hqdefault', 'mqdefault').replace
 
 
 if config.external_proxy:
-    def _ext_proxy_mapper(url):
+    def _ext_proxy_mapper(url, *_):
         parsed = urllib.parse.urlparse(url)._asdict()
         parsed['url'] = url
         encoded = {key + '_encoded': urllib.parse.quote_plus(value) for (key, value) in parsed.items()}
@@ -45,9 +51,20 @@ if config.external_proxy:
     if config.proxy_images: prop_mappers['map_image_url'] = lambda url: _ext_proxy_mapper(_fix_thumbnail_hq(url))
     if config.proxy_videos: prop_mappers['map_stream_url'] = _ext_proxy_mapper
 else:
-    if config.proxy_images: prop_mappers['map_image_url'] = logged(lambda url: url_for('ytimg', url=_fix_thumbnail_hq(url)))
+    if config.proxy_images:
+        prop_mappers['map_image_url'] = logged(lambda url: url_for('ytimg', url=_fix_thumbnail_hq(url)))
+
+        def _map_image_urls(urls):  # builds the route once, rather than per url
+            prefix, mapped = url_for('ytimg', url='_')[:-1], {}
+            return [mapped.setdefault(url, prefix + urllib.parse.quote(_fix_thumbnail_hq(url), safe='/:')) for url in urls]
+        prop_mappers['map_image_urls'] = _map_image_urls
     else: prop_mappers['map_image_url'] = _fix_thumbnail_hq
-    if config.proxy_videos: prop_mappers['map_stream_url'] = lambda url: url_for('ytstream', url=url)
+    if config.proxy_videos:
+        prop_mappers['map_stream_url'] = lambda url, vid=None: url_for('ytstream', url=url, v=vid, k=stream_signature(url, vid) if vid else None)
+
+
+# started with the app, in every worker: the first one to take the host lock runs it (see FeedRefresher)
+if config.feed_refresh: FeedRefresher(app).start()
 
 
 def _prepare_markup(string):
@@ -135,17 +152,18 @@ def ytgallery():
 @login_required
 def ytfeed():
     max_days = 365
+    before = request.args.get('before', None, type=dbFeedEntry.parse_cursor)
     # start_time = time.time()
-    videos = []
-    for cid in current_user.yt_subscribed_channel_ids:
-        recents = ytChannel(cid).get_recent_videos(max_days=max_days)
-        videos.extend([video for video in recents if not current_user.has_watched_video(video.id)])
-    for pid in current_user.yt_followed_playlist_ids:
-        recents = ytPlaylist(pid).get_recent_videos(max_days=max_days)
-        videos.extend([video for video in recents if not current_user.has_watched_video(video.id)])
-    videos.sort(key=attrgetter('published'), reverse=True)
+    if before is None:  # make sure expired feeds are fetched (and merged into the feed table) first; older pages come from the table
+        sources = [ytChannel(cid) for cid in current_user.yt_subscribed_channel_ids] + [ytPlaylist(pid) for pid in current_user.yt_followed_playlist_ids]
+        ready = prefetch(sources, ['recent_videos'], timeout=config.feed_fetch_timeout)
+        if len(ready) < len(sources): flash(f'{len(sources) - len(ready)} subscriptions are still loading, refresh the page to see them', 'info')
+    videos, cursor = current_user.get_feed_videos(limit=50, max_days=max_days, before=before)
+    current_user.prefetch_watched(v.id for v in videos)
+    next_page = f'{request.path}?before={cursor}' if cursor else None
+    prev_page = request.path if before is not None else None
     # print("--- {} seconds fetching youtube feed---".format(time.time() - start_time))
-    return render_template('ytfeed.html', title='Feed', videos=videos[:50], include_channel_header=True)
+    return render_template('ytfeed.html', title='Feed', videos=videos, include_channel_header=True, next_page=next_page, prev_page=prev_page)
 
 
 @app.route('/subscriptions', methods=['GET', 'POST'])
@@ -170,6 +188,7 @@ def ytsearch():
     if query:
         with db.session.no_autoflush:
             results = yt_search(query, page, sort, autocorrect)
+            current_user.prefetch_watched(v.id for v in results.get('videos', []))
             if page < results['num_pages']: next_page = f'{request.path}?s={sort}&p={page + 1}'
             if page > 1: prev_page = f'{request.path}?s={sort}&p={page - 1}'
     return render_template('ytsearch.html', title='Search', results=results, include_channel_header=True, next_page=next_page, prev_page=prev_page)
@@ -193,6 +212,13 @@ def ytchannel(cid):
     return _channel_page(request, ytChannel(cid))
 
 
+# the props each page touches, fetched concurrently before rendering (see PrefetchPlan)
+CHANNEL_PAGE = ytChannel.plan('name', 'avatar', 'description', 'num_video_pages')
+PLAYLIST_PAGE = ytPlaylist.plan('title', 'thumbnail', 'description', 'num_video_pages', 'cid')
+VIDEO_PAGE = ytVideo.plan('title', 'thumbnail', 'cid', 'channel_name', 'view_count', 'rating', 'description', 'is_live',
+                          'av_sources', 'audio_sources', 'caption_sources')
+
+
 def _channel_page(request, ch):
     with db.session.no_autoflush:
         if (config.restricted_mode and current_user.is_restricted and not ch.is_allowed) or (not current_user.is_admin and ch.is_blocked):
@@ -200,7 +226,10 @@ def _channel_page(request, ch):
         form = ChannelForm()  # TODO
         page = int(request.args.get('page', 1))
         sort = int(request.args.get('sort', 3))
-        videos = ch.get_videos(page=page, sort=sort)
+        videos = submit(ch.get_videos, page=page, sort=sort)
+        CHANNEL_PAGE.run(ch)
+        videos = videos.result()
+        current_user.prefetch_watched(v.id for v in videos)
         next_page, prev_page = None, None
         if page < ch.num_video_pages: next_page = f'{request.path}?sort={sort}&page={page + 1}'
         if page > 1: prev_page = f'{request.path}?sort={sort}&page={page - 1}'
@@ -221,7 +250,7 @@ def playlist_arg():
 
 def _playlist_page(request, pid):
     pl = ytPlaylist(pid)
-    ch = ytChannel(pl.cid)
+    ch = ytChannel(pl.cid)  # only what the check needs, nothing else is fetched for hidden playlists
     with db.session.no_autoflush:
         # in restricted mode, all playlists from allowed channels are allowed
         if (config.restricted_mode and current_user.is_restricted and not (pl.is_allowed or ch.is_allowed)) or (not current_user.is_admin and ch.is_blocked):  # or pl.is_blocked:
@@ -232,7 +261,10 @@ def _playlist_page(request, pid):
 
         page = int(request.args.get('page', 1))
         sort = int(request.args.get('sort', 3))
-        videos = pl.get_videos(page=page)
+        videos = submit(pl.get_videos, page=page)
+        PLAYLIST_PAGE.run(pl)
+        videos = videos.result()
+        current_user.prefetch_watched(v.id for v in videos)
         next_page, prev_page = None, None
         if page < pl.num_video_pages: next_page = f'{request.path}?sort={sort}&page={page + 1}'
         if page > 1: prev_page = f'{request.path}?sort={sort}&page={page - 1}'
@@ -307,16 +339,65 @@ def watch():
     return _video_page(request, ytVideo(vid))
 
 
-def _video_page(request, video):
+def _video_hidden(video):
     ch = ytChannel(video.cid)
     # TODO check allow playlists
-    if (config.restricted_mode and (not current_user.is_authenticated or current_user.is_restricted) and not ch.is_allowed) or ch.is_blocked:
-        video = ytVideo('NOTFOUND')._make_error('Video not found')
+    return (config.restricted_mode and (not current_user.is_authenticated or current_user.is_restricted) and not ch.is_allowed) or ch.is_blocked
+
+
+def _related_shown(): return config.remove_related is False or (config.remove_related == 'restricted' and not current_user.is_restricted)
+
+
+# related videos and comments are left out of the page, which loads them from their fragment endpoints once rendered
+def _video_page(request, video):
+    loading = VIDEO_PAGE.start(video)  # fetched while the restriction check resolves the cid (oembed)
+    if _video_hidden(video): video = ytVideo('NOTFOUND')._make_error('Video not found')  # the loads finish in the background
+    else: VIDEO_PAGE.wait(loading)
 
     _prepare_markup_mapper()
-    related_videos = []
-    if config.remove_related is False or (config.remove_related == 'restricted' and not current_user.is_restricted): related_videos = video.related_videos
-    return render_template('ytvideo.html', title=f'Video: {video.title}', video=video, related_videos=related_videos, include_channel_header=True, comments=[])
+    current_user.prefetch_watched([video.id])
+    return render_template('ytvideo.html', title=f'Video: {video.title}', video=video, show_related=_related_shown() and not video.invalid)
+
+
+def _video_json(v):
+    return {'id': v.id, 'title': v.title, 'thumbnail': v.thumbnail, 'cid': v.cid, 'channel_name': v.channel_name, 'duration': v.duration_human,
+            'published': v.timestamp_human, 'view_count': v.view_count, 'url': url_for('ytvideo', id=v.id)}
+
+
+@app.route('/_frag/related/<id>', defaults={'fmt': 'html'})
+@app.route('/_frag/related/<id>.json', defaults={'fmt': 'json'})
+@check_login
+def related_fragment(id, fmt):
+    video = ytVideo(id)
+    related_videos = video.related_videos if _related_shown() and not _video_hidden(video) else []
+    if fmt == 'json': return Response(json.dumps({'videos': [_video_json(v) for v in related_videos]}), mimetype='application/json')
+    current_user.prefetch_watched(v.id for v in related_videos)
+    return _render_fragment('_related_videos.html', video, 'Related videos', related_videos=related_videos, include_channel_header=True)
+
+
+CONTINUATION = re.compile(r'[\w%=-]{1,2048}')  # youtube's continuation tokens are urlsafe base64
+
+
+@app.route('/_frag/comments/<id>', defaults={'fmt': 'html'})
+@app.route('/_frag/comments/<id>.json', defaults={'fmt': 'json'})
+@check_login
+def comments_fragment(id, fmt):
+    video = ytVideo(id)
+    sort, continuation = request.args.get('sort', 0, type=int), request.args.get('ct')
+    if continuation and not CONTINUATION.fullmatch(continuation): return Response('Invalid continuation token', status=400)
+    comments = {'comments': [], 'continuation': None} if _video_hidden(video) else video.get_comments(sort=sort, continuation=continuation)
+    next_page = url_for('comments_fragment', id=id, fmt=fmt, sort=sort, ct=comments['continuation']) if comments['continuation'] else None
+    if fmt == 'json': return Response(json.dumps({'comments': comments['comments'], 'next': next_page}), mimetype='application/json')
+    return _render_fragment('_comments.html', video, 'Comments', 'ui comments', comments=comments['comments'], author=video.channel_name, next_page=next_page)
+
+
+def _render_fragment(template, video, title, fragment_class='', **context):
+    '''`template` alone for the video page's script, or in the layout for browsers without javascript (its noscript links)'''
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest': html = render_template(template, **context)
+    else: html = render_template('_fragment_page.html', title=f'{title}: {video.title}', video=video, fragment=template, fragment_class=fragment_class, **context)
+    response = Response(html)
+    response.vary.add('X-Requested-With')
+    return response
 
 
 @app.route('/_upd/watched', methods=['POST'])
@@ -327,25 +408,76 @@ def update_watched():
 
 
 #  PROXY videos through Yotter server to the client.
-@app.route('/stream/<path:url>', methods=['GET', 'POST'])
-@check_login
-def ytstream(url):
-    s = requests.Session()
-    s.verify = True
-    from_gv = s.get(url, stream=True, headers=Headers({'Range': request.headers['Range']}))
-    resp_headers = Headers({
-        'Content-Range': from_gv.headers.get('Content-Range'),
-        'Content-Length': from_gv.headers.get('Content-Length'),
-        'Accept-Ranges': 'bytes',
-    })
-    response = Response(from_gv.iter_content(chunk_size=10 * 1024), status=from_gv.status_code, mimetype=from_gv.headers['Content-Type'],
-                        content_type=from_gv.headers['Content-Type'], direct_passthrough=True, headers=resp_headers)
+# Streams are relayed a chunk at a time: the next chunk is only read from upstream once the previous one has been written to
+# the client, so memory per stream is fixed and a slow client slows down its upstream read (under gevent workers, see
+# gunicorn.conf.py, a waiting stream only holds a greenlet). Client disconnects close the upstream connection.
+PROXY_CHUNK = 64 * 1024
+PROXY_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+PROXY_RESPONSE_HEADERS = ('Content-Range', 'Content-Length', 'Content-Encoding', 'ETag', 'Last-Modified')
+
+
+def proxy_response(url, max_age, **headers):
+    upstream = httpclient.proxy.get(url, stream=True, headers={h: request.headers[h] for h in PROXY_REQUEST_HEADERS if h in request.headers})
+
+    def relay():
+        try: yield from upstream.raw.stream(PROXY_CHUNK, decode_content=False)
+        finally: upstream.close()
+    resp_headers = Headers(dict({h: upstream.headers[h] for h in PROXY_RESPONSE_HEADERS if h in upstream.headers}, **headers))
+    response = Response(relay(), status=upstream.status_code, content_type=upstream.headers.get('Content-Type'), direct_passthrough=True, headers=resp_headers)
     # enable browser file caching with etags
     response.cache_control.public = True
-    response.cache_control.max_age = int(60000)
+    response.cache_control.max_age = max_age
+    return response
+
+
+# Streams of known videos (`v` given by map_stream_url) are served through the segment cache. Cached segments are shared by
+# everyone watching the video, so `v` is only trusted along with `k`, our signature of the (googlevideo) url for that video
+streams = StreamCache(os.path.join(config.cache_dir, 'streams'), config.stream_cache_mb * 2**20) if config.stream_cache_mb else None
+VIDEO_ID = re.compile(r'[\w-]{11}')
+STREAM_HOST = re.compile(r'[\w.-]+\.googlevideo\.com')
+
+
+def stream_signature(url, vid):
+    return hmac.new(app.secret_key.encode(), f'{vid}\n{url}'.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def cached_stream_response(url, vid, max_age):
+    parsed = urllib.parse.urlparse(url)
+    if not (VIDEO_ID.fullmatch(vid) and parsed.scheme == 'https' and STREAM_HOST.fullmatch(parsed.hostname or '')): return None
+    if not hmac.compare_digest(request.args.get('k', ''), stream_signature(url, vid)): return None
+    params = urllib.parse.parse_qs(parsed.query)
+    itag, length, mime = params.get('itag', [''])[0], params.get('clen', [''])[0], params.get('mime', ['video/mp4'])[0]
+    if not (itag.isdigit() and length.isdigit()) or (request.range and len(request.range.ranges) != 1): return None
+    length = int(length)
+    span = request.range.range_for_length(length) if request.range else (0, length)
+    if span is None: return Response(status=416, headers={'Content-Range': f'bytes */{length}'})
+    start, stop = span
+    body = streams.stream(f'{vid}.{itag}', url, length, start, stop - 1)
+    try: first = next(body, b'')  # fetch the first (missing) segment now, so upstream errors can still be passed on
+    except StreamFetchError as e: return Response(e.response.content, status=e.response.status_code, content_type=e.response.headers.get('Content-Type'))
+
+    def relay():
+        try:
+            yield first
+            yield from body
+        finally: body.close()
+    response = Response(relay(), status=206 if request.range else 200, content_type=mime, direct_passthrough=True)
+    if request.range: response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
     return response
 
 
+@app.route('/stream/<path:url>', methods=['GET', 'POST'])
+@check_login
+def ytstream(url):
+    vid = request.args.get('v')
+    response = cached_stream_response(url, vid, 60000) if vid and streams else None
+    return response or proxy_response(url, 60000, **{'Accept-Ranges': 'bytes'})
+
+
 ######################### TEST
 # def copy_h(h,keys):
 #     r=Headers()
@@ -411,16 +543,43 @@ def download_file(streamable):
             yield chunk
 
 
-# Proxy yt images through server
-@fscache.memoize(timeout=86400)
+# Proxy yt images through server, from the disk cache
+images = ImageCache(os.path.join(config.cache_dir, 'images'), config.image_cache_mb * 2**20, revalidate=86400)
+
+
+def image_response(img, max_age):
+    if request.if_none_match.contains(img.digest): response = Response(status=304)
+    else: response = send_file(images.file(img.digest), mimetype=img.content_type)  # sendfile through wsgi.file_wrapper
+    response.set_etag(img.digest)
+    if img.last_modified: response.headers['Last-Modified'] = img.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+def image_format():
+    '''the preferred (smallest) format among the transcodable ones the client accepts, if any'''
+    accepted = set(request.accept_mimetypes.values())  # explicitly, not through */*
+    formats = [mt for mt in config.image_formats if mt in transcodable and mt in accepted]
+    return formats[0] if formats else None
+
+
+@app.template_filter('sized')
+def sized_image_url(url, width):
+    '''`url`, for proxied images, asking for it resized to `width` (see IMAGE_WIDTHS)'''
+    return f'{url}?w={width}' if url.startswith(url_for('ytimg', url='_')[:-1]) else url
+
+
 @app.route('/ytimg/<path:url>')
 @check_login
 def ytimg(url):
-    pic = requests.get(url, stream=True)
-    response = Response(pic, mimetype=pic.headers['Content-Type'], direct_passthrough=True)
-    # extend browser file caching with etags (ytimg uses 7200)
-    response.cache_control.public = True
-    response.cache_control.max_age = int(60000)
+    try: img = images.fetch(url)
+    except ImageFetchError as e: return Response(e.response.content, status=e.response.status_code, content_type=e.response.headers.get('Content-Type'))
+    width, mimetype = request.args.get('w', type=int), image_format()
+    if width not in IMAGE_WIDTHS or not resizable: width = None
+    if width or mimetype: img = images.variant(img, width, mimetype)
+    response = image_response(img, 60000)  # extend browser file caching (ytimg uses 7200)
+    if transcodable: response.vary.add('Accept')
     return response
 
 
@@ -553,13 +712,70 @@ def get_admin_list(cls, **kw):
     return [cls(o.id) for o in dbcls.query.filter_by(**kw).all()]
 
 
+def get_dead_subscriptions():
+    '''subscribed channels and followed playlists that youtube recently reported as invalid'''
+    dead, now = [], datetime.now().timestamp()
+    for kind, dbcls, assoc, fk in (('ytChannel', dbChannel, dbChannelSubscription, dbChannelSubscription.channel_rowid),
+                                   ('ytPlaylist', dbPlaylist, dbPlaylistFollow, dbPlaylistFollow.playlist_rowid)):
+        counts = dict(db.session.query(dbcls.id, db.func.count(assoc.user_rowid)).join(assoc, fk == dbcls.rowid).group_by(dbcls.id))
+        for id, entry in dead_ids.get_many(kind, list(counts)).items():
+            dead.append(dict(entry, kind=kind, id=id, users=counts[id], avoided=entry['until'] > now))
+    return sorted(dead, key=lambda d: d['last'], reverse=True)
+
+
 @app.route('/_admin/manage_lists')
 @admin_required
 def manage_admin_lists():
     blocked_channels = get_admin_list(ytChannel, is_blocked=True)
     allowed_channels = get_admin_list(ytChannel, is_allowed=True)
     allowed_playlists = get_admin_list(ytPlaylist, is_allowed=True)
-    return render_template('ytadmin.html', title='Admin', show_admin_actions=True, blocked_channels=blocked_channels, allowed_channels=allowed_channels, allowed_playlists=allowed_playlists)
+    return render_template('ytadmin.html', title='Admin', show_admin_actions=True, blocked_channels=blocked_channels, allowed_channels=allowed_channels, allowed_playlists=allowed_playlists,
+                           dead_subscriptions=get_dead_subscriptions(), fromtimestamp=datetime.fromtimestamp)
+
+@app.route('/_admin/dead_subscriptions.json')
+@admin_required
+def dead_subscriptions_json():
+    return Response(json.dumps(get_dead_subscriptions()), mimetype='application/json')
+
+CACHES = (('cache', cache), ('fscache', fscache), ('comments', commentcache))
+
+
+@app.after_request
+def publish_metrics(response):
+    metrics.publish(fscache)  # for the totals of all workers in the stats, throttled
+    return response
+
+
+def get_cache_stats():
+    '''fetcher metrics summed over all the workers, the rest (in-process structures and connection pools) for this worker'''
+    stats = dict(metrics.gather(fscache), identity_maps=[cls.__identity_map__.stats() for cls in (ytVideo, ytChannel, ytPlaylist)])
+    stats['caches'] = {name: c.cache.stats() for name, c in CACHES if hasattr(c.cache, 'stats')}
+    stats['l1_caches'] = [c.l1.stats() for _, c in CACHES if c.l1]
+    stats['http'] = [c.stats() for c in httpclient.clients]
+    stats['caches']['images'] = images.stats()
+    if streams: stats['caches']['streams'] = streams.stats()
+    return stats
+
+
+@app.route('/_admin/stats')
+@admin_required
+def admin_stats():
+    stats = get_cache_stats()
+    fetchers = sorted(stats['fetchers'].items(), key=lambda i: i[1]['seconds'], reverse=True)
+    namespaces = sorted(name for _, c in CACHES for name in c.memoized)
+    return render_template('ytstats.html', title='Cache statistics', stats=stats, fetchers=fetchers, since=datetime.fromtimestamp(stats['since']), namespaces=namespaces)
+
+@app.route('/_admin/stats.json')
+@admin_required
+def admin_stats_json():
+    return Response(json.dumps(get_cache_stats()), mimetype='application/json')
+
+@app.route('/_admin/reset_stats', methods=['POST'])
+@admin_required
+def reset_stats():
+    metrics.reset_all(fscache)
+    flash('Statistics reset', 'info')
+    return redirect(request.referrer)
 
 @app.route('/_admin/<what>/<where>/<action>/<id>', methods=['POST'])
 @admin_required
@@ -645,12 +861,44 @@ def clear_inactive_users():
 @app.route('/_admin/purge_cache', methods=['POST'])
 @admin_required
 def purge_cache():
-    fscache.clear()
-    cache.clear()
+    for _, c in CACHES: c.clear()
+    for cls in (ytVideo, ytChannel, ytPlaylist):
+        cls.__identity_map__.clear()
+        purges.purged(cls.__name__)  # other workers' instances
     flash(f'Cache purged', 'warning')
     return redirect(request.referrer)
 
 
+@app.route('/_admin/purge_cache/<name>', methods=['POST'])
+@admin_required
+def purge_cache_namespace(name):
+    '''purge the entries of one memoized function (eg `ytVideo._get_page`) or, for a class name, of all its propgroups'''
+    n = sum(c.purge_memoized(name) for _, c in CACHES)
+    if not n: flash(f'Nothing cached as "{name}"', 'error')
+    else:
+        for cls in (ytVideo, ytChannel, ytPlaylist):  # instances hold on to their props too
+            if name.split('.')[0] == cls.__name__:
+                cls.__identity_map__.clear()
+                purges.purged(cls.__name__)
+        flash(f'Purged "{name}" ({n} functions)', 'warning')
+    return redirect(request.referrer)
+
+@app.route('/_admin/purge_object', methods=['POST'])
+@admin_required
+def purge_cache_object():
+    classes = {'video': ytVideo, 'channel': ytChannel, 'playlist': ytPlaylist}
+    what, id = request.form.get('what'), request.form.get('id', '').strip()
+    if what not in classes or not id: return redir_error(405)
+    cls = classes[what]
+    obj = cls(id)
+    for _, c in CACHES: c.purge_memoized(cls.__name__, obj)
+    cls.__identity_map__.delete(hash(id))
+    purges.purged(cls.__name__)  # other workers may hold the instance too
+    dead_ids.revived(cls.__name__, id)
+    flash(f'Purged {what} "{id}" from the cache', 'warning')
+    return redirect(request.referrer)
+
+
 @app.route('/_admin/purge_db', methods=['POST'])
 @admin_required
 def purge_db():
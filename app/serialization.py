@@ -0,0 +1,81 @@
+import datetime
+import json
+import pickle
+try: import msgpack
+except ImportError: msgpack = None
+
+# classes whose instances are stored by id (plus their flat props) and rehydrated through their identity map
+classes = {}
+# namedtuple classes, stored as their fields
+tuples = {}
+UTC = datetime.timezone.utc
+# keys of the dicts standing for other values; dicts of the payload having any of them are wrapped in {'$d': dict}
+TAGS = ('$t', '$n', '$o', '$r', '$u', '$d')
+
+
+def register(cls):
+    classes[cls.__name__] = cls
+    return cls
+
+
+def register_tuple(cls):
+    tuples[cls.__name__] = cls
+    return cls
+
+
+def _is_flat(v):
+    if isinstance(v, (list, tuple)): return all(isinstance(i, (str, int, float, bool)) or i is None for i in v)
+    return isinstance(v, (str, int, float, bool, datetime.datetime)) or v is None
+
+
+def _to_tree(v):
+    if isinstance(v, dict):
+        tree = {k: _to_tree(i) for k, i in v.items()}
+        return {'$d': tree} if any(k in TAGS for k in tree) else tree
+    if isinstance(v, list): return [_to_tree(i) for i in v]
+    if isinstance(v, tuple):
+        if type(v).__name__ in tuples: return {'$r': type(v).__name__, 'f': [_to_tree(i) for i in v]}
+        return {'$u': [_to_tree(i) for i in v]}
+    if isinstance(v, datetime.datetime):
+        if v.tzinfo: return {'$t': v.timestamp()}
+        return {'$n': v.replace(tzinfo=UTC).timestamp()}
+    if type(v).__name__ in classes:
+        # objects inside a payload only carry their own flat (list-level) props, never other objects or nested data
+        return {'$o': type(v).__name__, 'id': v.id, 'p': _to_tree({k: i for k, i in v._pg_dump().items() if _is_flat(i)})}
+    return v
+
+
+def _from_tree(v):
+    if isinstance(v, list): return [_from_tree(i) for i in v]
+    if not isinstance(v, dict): return v
+    if '$d' in v: return {k: _from_tree(i) for k, i in v['$d'].items()}
+    if '$u' in v: return tuple(_from_tree(i) for i in v['$u'])
+    if '$r' in v: return tuples[v['$r']](*[_from_tree(i) for i in v['f']])
+    if '$t' in v: return datetime.datetime.fromtimestamp(v['$t'], UTC)
+    if '$n' in v: return datetime.datetime.fromtimestamp(v['$n'], UTC).replace(tzinfo=None)
+    if '$o' in v:
+        obj = classes[v['$o']](v['id'])
+        obj._pg_restore(_from_tree(v['p']))
+        return obj
+    return {k: _from_tree(i) for k, i in v.items()}
+
+
+class PayloadSerializer(object):
+    '''Compact, object-free encoding for cached payloads: yt objects are stored as their id plus flat props, datetimes as
+    timestamps, tuples (and registered namedtuples) as lists, all as msgpack (if available) or JSON; anything else falls back
+    to pickle. Encoded values are dicts keyed by a tag (see TAGS), so payload dicts using those keys are escaped.'''
+    def dumps(self, value):
+        tree = _to_tree(value)
+        try:
+            if msgpack: return b'M' + msgpack.packb(tree, use_bin_type=True)
+            return b'J' + json.dumps(tree, separators=(',', ':')).encode()
+        except (TypeError, ValueError): return b'P' + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        fmt, data = data[:1], data[1:]
+        if fmt == b'M': return _from_tree(msgpack.unpackb(data, raw=False))
+        if fmt == b'J': return _from_tree(json.loads(data))
+        return pickle.loads(data)
+
+
+payloads = PayloadSerializer()
@@ -0,0 +1,157 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask_caching.backends.base import BaseCache
+
+NEVER = 2 ** 62
+ACCESS_RESOLUTION = 60  # only record accesses (for LRU) this many seconds apart, to keep reads mostly read-only
+PRUNE_EVERY = 200  # sets (by this process) between pruning passes
+PRUNE_INTERVAL = 300  # or seconds, if anything was set meanwhile
+MAX_VARS = 500  # stay below sqlite's max bound parameters
+
+
+class ConnectionPool(object):
+    '''A few SQLite connections (in WAL mode, so readers don't block the writer and vice versa) shared by all the threads and
+    greenlets of a process; thread locals won't do, under gevent they're per greenlet, so per request.'''
+    def __init__(self, path, size=4):
+        self.path, self.size = path, size
+        self._idle, self._lock = [], threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock: conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA recursive_triggers=ON')  # so that INSERT OR REPLACE fires delete triggers
+        try: yield conn
+        finally:
+            if conn.in_transaction: conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.size: self._idle.append(conn); conn = None
+            if conn is not None: conn.close()
+
+
+class PruneSchedule(object):
+    '''Counts the writes of this process to a cache: `due` says when it's time for a pruning pass, every `every` writes or
+    `interval` seconds (if anything was written meanwhile).'''
+    def __init__(self, every=PRUNE_EVERY, interval=PRUNE_INTERVAL):
+        self.every, self.interval = every, interval
+        self._writes, self._last, self._lock = 0, time.time(), threading.Lock()
+
+    def due(self, n=1):
+        with self._lock:
+            self._writes += n
+            if self._writes < self.every and time.time() - self._last < self.interval: return False
+            self._writes, self._last = 0, time.time()
+            return True
+
+
+class SQLiteCache(BaseCache):
+    '''Persistent cache in a single SQLite file (in WAL mode, so readers don't block the writer and vice versa), shareable
+    between processes. Expiry is indexed, and the cache is kept within `max_bytes` by evicting least recently used entries;
+    the total size is kept up to date by triggers, so checking it doesn't take a scan.'''
+    def __init__(self, path, max_bytes=512 * 2**20, default_timeout=300, key_prefix=''):
+        super(SQLiteCache, self).__init__(default_timeout)
+        self.path, self.max_bytes, self.key_prefix = path, max_bytes, key_prefix
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._pool, self._prunes = ConnectionPool(path), PruneSchedule()
+        with self._conn() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL, size INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)')
+            conn.execute('INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0) FROM cache')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS tr_cache_insert AFTER INSERT ON cache BEGIN UPDATE totals SET size = size + NEW.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS tr_cache_delete AFTER DELETE ON cache BEGIN UPDATE totals SET size = size - OLD.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS tr_cache_update AFTER UPDATE OF size ON cache BEGIN '
+                         'UPDATE totals SET size = size + NEW.size - OLD.size; END')
+
+    def _conn(self): return self._pool.connection()
+
+    def _expires(self, timeout):
+        if timeout is None: timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else NEVER
+
+    def _row(self, key, value, timeout):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return (self.key_prefix + key, blob, self._expires(timeout), time.time(), len(blob))
+
+    def get(self, key): return self.get_many(key)[0]
+
+    def get_many(self, *keys):
+        now, found, stale = time.time(), {}, []
+        with self._conn() as conn:
+            for i in range(0, len(keys), MAX_VARS):
+                chunk = [self.key_prefix + k for k in keys[i:i + MAX_VARS]]
+                q = f'SELECT key, value, accessed FROM cache WHERE key IN ({",".join("?" * len(chunk))}) AND expires > ?'
+                for k, blob, accessed in conn.execute(q, (*chunk, now)).fetchall():
+                    try: found[k] = pickle.loads(blob)
+                    except Exception: continue
+                    if accessed < now - ACCESS_RESOLUTION: stale.append(k)
+            if stale:
+                with conn: conn.executemany('UPDATE cache SET accessed = ? WHERE key = ?', [(now, k) for k in stale])
+        return [found.get(self.key_prefix + k) for k in keys]
+
+    def get_dict(self, *keys): return dict(zip(keys, self.get_many(*keys)))
+
+    def has(self, key):
+        with self._conn() as conn:
+            return conn.execute('SELECT 1 FROM cache WHERE key = ? AND expires > ?', (self.key_prefix + key, time.time())).fetchone() is not None
+
+    def set(self, key, value, timeout=None): return self.set_many({key: value}, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        rows = [self._row(k, v, timeout) for k, v in mapping.items()]
+        with self._conn() as conn, conn: conn.executemany('INSERT OR REPLACE INTO cache (key, value, expires, accessed, size) VALUES (?, ?, ?, ?, ?)', rows)
+        if self._prunes.due(len(mapping)): self._prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        '''Atomic: only sets the value if there's no live entry for `key`.'''
+        with self._conn() as conn, conn:
+            cur = conn.execute('INSERT INTO cache (key, value, expires, accessed, size) VALUES (?, ?, ?, ?, ?) '
+                               'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires, accessed = excluded.accessed, '
+                               'size = excluded.size WHERE cache.expires <= ?', (*self._row(key, value, timeout), time.time()))
+        return cur.rowcount > 0
+
+    def delete(self, key): return self.delete_many(key)
+
+    def delete_many(self, *keys):
+        with self._conn() as conn, conn:
+            for i in range(0, len(keys), MAX_VARS):
+                chunk = [self.key_prefix + k for k in keys[i:i + MAX_VARS]]
+                conn.execute(f'DELETE FROM cache WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+        return True
+
+    def clear(self):
+        with self._conn() as conn, conn: conn.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(self.key_prefix), self.key_prefix))
+        return True
+
+    def _prune(self):
+        '''Drop expired entries, then the least recently used ones until the cache fits in `max_bytes`.'''
+        with self._conn() as conn, conn:
+            conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            excess = conn.execute('SELECT size FROM totals').fetchone()[0] - self.max_bytes
+            while excess > 0:
+                victims = []
+                for k, size in conn.execute('SELECT key, size FROM cache ORDER BY accessed LIMIT ?', (MAX_VARS,)).fetchall():
+                    if excess <= 0: break
+                    victims.append(k)
+                    excess -= size
+                if not victims: break
+                conn.execute(f'DELETE FROM cache WHERE key IN ({",".join("?" * len(victims))})', victims)
+
+    def stats(self):
+        with self._conn() as conn: entries, size = conn.execute('SELECT COUNT(*), (SELECT size FROM totals) FROM cache').fetchone()
+        return {'entries': entries, 'bytes': size or 0, 'max_bytes': self.max_bytes}
+
+
+# flask-caching backend factory, for `CACHE_TYPE: 'app.sqlitecache.sqlite_cache'`
+def sqlite_cache(app, config, args, kwargs):
+    kwargs.update(path=config['CACHE_SQLITE_PATH'], max_bytes=config['CACHE_MAX_BYTES'], key_prefix=config.get('CACHE_KEY_PREFIX') or '')
+    return SQLiteCache(*args, **kwargs)
@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+import time
+
+from app import httpclient
+from app.sqlitecache import ConnectionPool, PruneSchedule
+
+SEGMENT = 2**20
+CHUNK = 64 * 1024
+ACCESS_RESOLUTION = 60  # only record accesses (for LRU) this many seconds apart
+PRUNE_EVERY = 50  # segments stored (by this process) between pruning passes
+STREAM_KEY = re.compile(r'[\w-]+\.\d+')  # video id.itag
+
+
+class StreamFetchError(Exception):
+    def __init__(self, response):
+        super(StreamFetchError, self).__init__(f'{response.status_code} {response.url}')
+        self.response = response
+
+
+class StreamCache(object):
+    '''On-disk cache of video and audio streams in fixed size segments, keyed by video id and itag rather than by the (signed,
+    expiring) url. Any byte range is served from the cached segments, and the missing ones are fetched from upstream (as
+    whole segments) while being relayed, so a partially cached range starts right away. Least recently used segments are
+    evicted beyond `max_bytes`; the index is an SQLite file shared by all processes.'''
+    def __init__(self, path, max_bytes):
+        self.path, self.max_bytes = path, max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._pool, self._prunes = ConnectionPool(os.path.join(path, 'index.sqlite')), PruneSchedule(PRUNE_EVERY)
+        with self._conn() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS segments (stream TEXT, n INTEGER, size INTEGER, accessed REAL, PRIMARY KEY (stream, n))')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_segments_accessed ON segments (accessed)')
+
+    def _conn(self): return self._pool.connection()
+
+    def file(self, stream, n):
+        if not STREAM_KEY.fullmatch(stream): raise ValueError(f'invalid stream key {stream!r}')  # it ends up in a path
+        return os.path.join(self.path, stream[:2], stream, str(n))
+
+    def _cached(self, stream, first, last):
+        now, cached, stale = time.time(), set(), []
+        with self._conn() as conn:
+            for n, accessed in conn.execute('SELECT n, accessed FROM segments WHERE stream = ? AND n BETWEEN ? AND ?', (stream, first, last)).fetchall():
+                cached.add(n)
+                if accessed < now - ACCESS_RESOLUTION: stale.append((now, stream, n))
+            if stale:
+                with conn: conn.executemany('UPDATE segments SET accessed = ? WHERE stream = ? AND n = ?', stale)
+        return cached
+
+    def _store(self, stream, n, tmp, size):
+        os.replace(tmp, self.file(stream, n))
+        with self._conn() as conn, conn: conn.execute('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)', (stream, n, size, time.time()))
+        if self._prunes.due(): self._prune()
+
+    def stream(self, stream, url, length, start, end):
+        '''yield bytes `start` to `end` (inclusive) of `stream` (`length` bytes in all), fetching missing segments from `url`'''
+        first, last = start // SEGMENT, end // SEGMENT
+        cached, n = self._cached(stream, first, last), first
+        while n <= last:
+            if n in cached:
+                try:
+                    yield from self._read(stream, n, start, end)
+                    n += 1
+                    continue
+                except FileNotFoundError: pass  # evicted meanwhile
+            run_end = n  # fetch consecutive missing segments with a single request
+            while run_end < last and run_end + 1 not in cached: run_end += 1
+            yield from self._fill(stream, url, length, n, run_end, start, end)
+            n = run_end + 1
+
+    def _read(self, stream, n, start, end):
+        with open(self.file(stream, n), 'rb') as f:
+            pos = max(start, n * SEGMENT)
+            f.seek(pos - n * SEGMENT)
+            while pos <= end:
+                chunk = f.read(min(CHUNK, end - pos + 1))
+                if not chunk: break
+                pos += len(chunk)
+                yield chunk
+
+    def _fill(self, stream, url, length, first, last, start, end):
+        lo, hi = first * SEGMENT, min((last + 1) * SEGMENT, length) - 1
+        resp = httpclient.proxy.get(url, stream=True, headers={'Range': f'bytes={lo}-{hi}'})
+        out, tmp, pos, n = None, None, lo, first
+        try:
+            if resp.status_code != 206: raise StreamFetchError(resp)
+            os.makedirs(os.path.dirname(self.file(stream, n)), exist_ok=True)
+            for chunk in resp.raw.stream(CHUNK, decode_content=False):
+                while chunk:
+                    if out is None:
+                        tmp = f'{self.file(stream, n)}.{os.getpid()}.{threading.get_ident()}'
+                        out = open(tmp, 'wb')
+                    seg_end = min((n + 1) * SEGMENT, length)
+                    part, chunk = chunk[:seg_end - pos], chunk[seg_end - pos:]
+                    out.write(part)
+                    a, b = max(pos, start), min(pos + len(part) - 1, end)
+                    if a <= b: yield part[a - pos:b - pos + 1]
+                    pos += len(part)
+                    if pos == seg_end:
+                        out.close()
+                        self._store(stream, n, tmp, seg_end - n * SEGMENT)
+                        out, n = None, n + 1
+        finally:
+            resp.close()
+            if out is not None:  # incomplete segment
+                out.close()
+                os.remove(tmp)
+
+    def _prune(self):
+        '''Evict the least recently used segments until the cache fits in `max_bytes`.'''
+        with self._conn() as conn, conn:
+            excess = (conn.execute('SELECT SUM(size) FROM segments').fetchone()[0] or 0) - self.max_bytes
+            victims = []
+            for stream, n, size in conn.execute('SELECT stream, n, size FROM segments ORDER BY accessed').fetchall():
+                if excess <= 0: break
+                victims.append((stream, n))
+                excess -= size
+            conn.executemany('DELETE FROM segments WHERE stream = ? AND n = ?', victims)
+        for stream, n in victims:
+            try: os.remove(self.file(stream, n))
+            except FileNotFoundError: pass
+
+    def stats(self):
+        with self._conn() as conn: entries, size = conn.execute('SELECT COUNT(*), SUM(size) FROM segments').fetchone()
+        return {'entries': entries, 'bytes': size or 0, 'max_bytes': self.max_bytes}
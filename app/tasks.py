@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from flask import current_app, has_app_context, has_request_context, copy_current_request_context
+from config import config
+
+
+fetch_pool = ThreadPoolExecutor(max_workers=config.fetch_workers, thread_name_prefix='yotter-fetch')
+
+
+def in_context(f):
+    '''Wrap `f` so that it runs inside a copy of the current request context (prop mappers use `url_for`), or at least inside the app context.'''
+    if has_request_context(): return copy_current_request_context(f)
+    app = current_app._get_current_object() if has_app_context() else None
+
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if app is None: return f(*args, **kwargs)
+        with app.app_context(): return f(*args, **kwargs)
+    return wrapped
+
+
+def submit(f, *args, **kwargs): return fetch_pool.submit(in_context(f), *args, **kwargs)
@@ -1,5 +1,5 @@
 import urllib
-from flask import Markup
+from markupsafe import escape
 import bleach
 def get_description_snippet_text(ds):
     string = ""
@@ -31,7 +31,8 @@ def parse_comment(raw_comment):
     cmnt['thumbnail'] = raw_comment['author_avatar']
 
     cmnt['channel'] = raw_comment['author_url']
-    cmnt['text'] = Markup(bleach.linkify(concat_texts(raw_comment['text']).replace("\n", "<br>")))
+    # sanitized html as a plain str, so it can be cached (see ytVideo._get_comments_page); mark it safe when rendering
+    cmnt['text'] = bleach.linkify(str(escape(concat_texts(raw_comment['text']) or '')).replace("\n", "<br>"))
     cmnt['date'] = raw_comment['time_published']
 
     try:
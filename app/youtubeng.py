@@ -1,14 +1,23 @@
-import requests
-from requests_futures.sessions import FuturesSession
 import datetime
 from dateutil.parser import parse as dateparse
 from humanize import naturaldelta, intword
 from functools import wraps
 import operator
+import re
 import math
 import json
+import time
+import urllib.parse
 import feedparser
-from app import cache, fscache
+from collections import OrderedDict
+from concurrent.futures import wait
+from app import cache, fscache, commentcache, httpclient
+from app import serialization
+from app.caching import IdentityMap, NegativeCache, PurgeStamps, expiring
+from app.metrics import instrumented, metrics
+from app.tasks import submit
+from app.utils import parse_comment
+from config import config
 #from youtube_search import YoutubeSearch
 
 import sys
@@ -19,22 +28,41 @@ import youtube.playlist
 import youtube.channel
 import youtube.watch
 import youtube.search
+import youtube.comments
+from youtube import yt_data_extract
 
 def utcnow(): return datetime.datetime.now(datetime.timezone.utc)
 
 class ATTRFLAG: pass
 
-_idfn = lambda v: v
+_idfn = lambda v, *_: v
 _trim_ago = lambda s: s[:-4] if s.endswith(' ago') else s
 
 
+# map_stream_url also gets the video id; map_image_urls maps a list at once (eg a page of comment avatars)
 prop_mappers = {
   'map_image_url': _idfn,
+  'map_image_urls': lambda urls: [prop_mappers['map_image_url'](url) for url in urls],
   'map_stream_url': _idfn,
   'map_markup': _idfn,
   'map_trim_ago': _idfn,
 }
 
+# called as listener(channel_or_playlist, videos) whenever a feed has been fetched from youtube
+feed_listeners = []
+
+# ids youtube reported as invalid (deleted, private, ...), by class name; they're not fetched again until their backoff expires
+dead_ids = NegativeCache(fscache, 'dead', config.negative_ttl, config.negative_max_ttl)
+# errors that say nothing about the id (rate limiting, timeouts, youtube being down) are only cached briefly
+TRANSIENT_ERROR = re.compile(r'timed out|timeout|temporar|try again|too many requests|\b(429|5\d\d)\b|connection', re.I)
+TRANSIENT_ERROR_TTL = 60
+
+
+def is_transient(error): return bool(TRANSIENT_ERROR.search(str(error)))
+
+# admin purges, by class name; instances in every worker reload the propgroups they loaded before (see `propgroups`)
+purges = PurgeStamps(fscache, 'purged', 5)
+
 
 def logged(f):
     @wraps(f)
@@ -44,8 +72,71 @@ def logged(f):
     return wrapped
 
 
+def prefetch(objs, props, timeout=None):
+    '''Resolve `props` on all `objs` concurrently on the fetch pool (warm propgroups are served straight from the cache).
+    Returns the objs, in order, that resolved within `timeout` seconds; the others keep fetching in the background and will be cached.'''
+    def resolve(obj):
+        for prop in props: getattr(obj, prop)
+    futures = [submit(resolve, obj) for obj in objs]
+    wait(futures, timeout=timeout)
+    ready = []
+    for obj, fut in zip(objs, futures):
+        if not fut.done(): continue
+        if fut.exception(): print(f'.prefetch {obj} failed: {fut.exception()!r}')
+        else: ready.append(obj)
+    return ready
+
+
+class PrefetchPlan(object):
+    '''The propgroups of `cls` behind `props` (the props a view will touch), as chains of groups to load in order: a group comes
+    after the groups its getter reads props from (`__propgroup_deps__`), independent chains are loaded concurrently by `run`.
+    Plans are meant to be made once, at import time (see `propgroups`' `plan`), so unknown props fail early.'''
+    def __init__(self, cls, props):
+        propgroup_of = {prop: grp for grp, gprops in cls.__propgroups__.items() for prop in gprops}
+        unknown = [prop for prop in props if prop not in propgroup_of]
+        if unknown: raise ValueError(f'{cls.__name__} has no propgroups for {unknown}')
+        deps = getattr(cls, '__propgroup_deps__', {})
+
+        def chain(grp):
+            return [g for dep in deps.get(grp, []) for g in chain(dep)] + [grp]
+        groups = {propgroup_of[prop] for prop in props}
+        chains = {grp: list(OrderedDict.fromkeys(chain(grp))) for grp in groups}
+        # groups that another chain loads anyway don't get their own
+        self.cls, self.props = cls, props
+        self.chains = [c for grp, c in sorted(chains.items()) if not any(grp in other[:-1] for other in chains.values())]
+        # the props to load each group through: all the planned ones, as setting one prop marks its whole group loaded
+        self.group_props = {grp: [prop for prop in props if propgroup_of[prop] == grp] or cls.__propgroups__[grp][:1]
+                            for c in self.chains for grp in c}
+
+    def __repr__(self): return f'<PrefetchPlan {self.cls.__name__} {self.chains}>'
+
+    def start(self, *objs):
+        '''Submit the loads of the planned propgroups of `objs` to the fetch pool (warm ones are served straight from the cache),
+        each chain in its own task, and return the tasks for `wait`.'''
+        def load(obj, chain):
+            for grp in chain:
+                for prop in self.group_props[grp]: obj._pg_load(grp, prop)
+        return [(obj, submit(load, obj, chain)) for obj in objs for chain in self.chains]
+
+    def run(self, *objs, timeout=None):
+        '''Load the planned propgroups of `objs` concurrently (see `start`).
+        Returns the objs, in order, that resolved within `timeout` seconds; the others keep fetching in the background.'''
+        return self.wait(self.start(*objs), timeout=timeout)
+
+    def wait(self, tasks, timeout=None):
+        '''Wait up to `timeout` seconds for `tasks` (from `start`); returns their objs, in order, that resolved.'''
+        objs = list(OrderedDict.fromkeys(obj for obj, _ in tasks))
+        wait([fut for _, fut in tasks], timeout=timeout)
+        failed = set()
+        for obj, fut in tasks:
+            if not fut.done() or fut.exception(): failed.add(obj.id)
+            if fut.done() and fut.exception(): print(f'.prefetch {obj} failed: {fut.exception()!r}')
+        return [obj for obj in objs if obj.id not in failed]
+
+
 ####################################################################
 # adapted from https://github.com/sqlalchemy/sqlalchemy/wiki/UniqueObject
+# `cache` must have a get/set interface (eg `IdentityMap`)
 def unique_constructor(hash=hash, cache={}):
     def _unique_cache(cache, cls, hashfunc, constructor, arg, kw):
         key = hashfunc(*arg, **kw)
@@ -57,6 +148,8 @@ def unique_constructor(hash=hash, cache={}):
 
     # class decorator
     def decorator(cls):
+        cls.__identity_map__ = cache
+
         def _null_init(self, *arg, **kw): pass
         cls._unique_init = cls.__init__
         cls.__init__ = _null_init
@@ -92,26 +185,86 @@ def propgroups(cl):
             setattr(self, k, v)  # including None for uninteresting props
     cl.__init__ = pginit
 
+    propgroup_of = {prop: grp for grp, props in cl.__propgroups__.items() for prop in props}
+
     def store_if_absent(self, prop, val):
-        if getattr(self, f'_{prop}', ATTRFLAG) is ATTRFLAG: setattr(self, prop, val)
+        expired = self.__dict__.get('_pg_expiry', {}).get(propgroup_of[prop], 0) < time.time()
+        if getattr(self, f'_{prop}', ATTRFLAG) is ATTRFLAG or expired: setattr(self, prop, val)
     cl.addprop = store_if_absent
     cl.setprop = lambda self, k, v: setattr(self, k, v)
 
-    def return_error(self, grp, error):
+    def return_error(self, grp, error, transient=False):
         resp, attrs, grpkeys = {}, {}, self.__propgroups__.get(grp, [])
         for k, v in self.__invalid_data__.items():
             if v == '__error__': v = error
             if k in grpkeys: resp[k] = v
             else: attrs[k] = v
         for k, v in attrs.items(): setattr(self, k, v)
-        return resp
+        if grp not in cl.__propgroups__: return resp
+        metrics.incr(f'{cl.__name__}._get_{grp}', 'errors')  # the upstream call went through, but youtube said no
+        if transient or is_transient(error): return expiring(resp, TRANSIENT_ERROR_TTL)  # youtube trouble, not a dead id
+        return expiring(resp, dead_ids.failed(cl.__name__, self.id, error))  # cached for the backoff ttl, not the group's
     cl._return_error = return_error
 
+    def revived(self):
+        '''after a successful fetch: forget past failures (and that the instance was invalid)'''
+        self.__dict__.pop('invalid', None)
+        dead_ids.revived(cl.__name__, self.id)
+    cl._revived = revived
+
     def make_error(self, error):
         self._return_error('__none', error)
         return self
     cl._make_error = make_error
 
+    # ttls from config, as `[soft, hard]` or `'soft:hard'` seconds; after the soft ttl, stale values are served while refreshing
+    for grp in cl.__propgroups__:
+        ttls = config.propgroup_ttls.get(f'{cl.__name__}.{grp}')
+        if not ttls: continue
+        soft, hard = ttls.split(':') if isinstance(ttls, str) else ttls
+        getter = getattr(cl, f'_get_{grp}')
+        getter.soft_timeout, getter.cache_timeout = int(soft) or None, int(hard)
+
+    # instances are shared across requests (see IdentityMap), so a group's props expire along with its cached dict
+    expires_prop = getattr(cl, '__propgroup_expires__', {})
+    def instance_ttl(getter): return getter.soft_timeout or getter.cache_timeout
+
+    def pgload(self, grp, prop):
+        ivar, expiry, loaded = f'_{prop}', self.__dict__.setdefault('_pg_expiry', {}), self.__dict__.setdefault('_pg_loaded', {})
+        # first access, invalidated, expired or purged since - rebuild cache
+        if not hasattr(self, ivar) or expiry.get(grp, 0) < time.time() or loaded.get(grp, 0) < purges.get(cl.__name__):
+            getter = getattr(self, f'_get_{grp}')
+            d = getter()
+            setattr(self, ivar, d[prop])
+            for k in cl.__propgroups__[grp]:
+                if k in d: setattr(self, f'_{k}', d[k])
+            expiry[grp] = time.time() + instance_ttl(getter)
+            expires = d.get(expires_prop.get(grp))  # unix time the group's values stop being valid, if it has one
+            if expires: expiry[grp] = min(expiry[grp], expires)
+            loaded[grp] = time.time()
+        return getattr(self, ivar)  # return cached result, including None
+    cl._pg_load = pgload
+
+    def pgdump(self):
+        '''the loaded (and not expired) props of this instance, for serialization'''
+        expiry, now = self.__dict__.get('_pg_expiry', {}), time.time()
+        return {prop: getattr(self, f'_{prop}') for prop in propnames if hasattr(self, f'_{prop}') and expiry.get(propgroup_of[prop], 0) >= now}
+    cl._pg_dump = pgdump
+
+    def pgrestore(self, props):
+        '''set props from a deserialized payload, unless already loaded (and not expired); unlike setprop this doesn't touch the cache'''
+        expiry, now = self.__dict__.setdefault('_pg_expiry', {}), time.time()
+        props = {k: v for k, v in props.items() if k in propgroup_of}
+        for prop, v in props.items():
+            if expiry.get(propgroup_of[prop], 0) < now or not hasattr(self, f'_{prop}'): setattr(self, f'_{prop}', v)
+        for grp in {propgroup_of[prop] for prop in props}:
+            if expiry.get(grp, 0) < now:
+                expiry[grp] = now + instance_ttl(getattr(self, f'_get_{grp}'))
+                self.__dict__.setdefault('_pg_loaded', {})[grp] = now
+    cl._pg_restore = pgrestore
+    cl.plan = classmethod(lambda cls, *props: PrefetchPlan(cls, props))
+    serialization.register(cl)
+
     for grp, props in cl.__propgroups__.items():
         # use a default arg to capture the value in the closure
         # https://stackoverflow.com/a/54289183
@@ -121,7 +274,7 @@ def propgroups(cl):
                 ivar = f'_{prop}'
                 if not hasattr(self, ivar): return
                 d[prop] = getattr(self, ivar)
-            getattr(self, f'_get_{grp}').set_cache(self, d)
+            getattr(self, f'_get_{grp}').set_cache(d, self)
         setattr(cl, f'_set_{grp}', setcache)
 
         def overridecache(self, grp=grp):
@@ -137,21 +290,17 @@ def propgroups(cl):
             mapper_key = cl.__prop_mappers__.get(prop, None)
             if mapper_key:
                 def pgetmapped(self, grp=grp, prop=prop, mapper_key=mapper_key):
-                    ivar = f'_{prop}'
-                    if not hasattr(self, ivar):  # first access (or invalidated) - rebuild cache
-                        setattr(self, ivar, getattr(self, f'_get_{grp}')()[prop])
-                    return prop_mappers[mapper_key](getattr(self, ivar))  # return cached result, including None
+                    return prop_mappers[mapper_key](self._pg_load(grp, prop))
 
-            def pget(self, grp=grp, prop=prop):
-                ivar = f'_{prop}'
-                if not hasattr(self, ivar):  # first access (or invalidated) - rebuild cache
-                    setattr(self, ivar, getattr(self, f'_get_{grp}')()[prop])
-                return getattr(self, ivar)  # return cached result, including None
+            def pget(self, grp=grp, prop=prop): return self._pg_load(grp, prop)
 
             # if set to None, it'll be cached - prop is deemed irrelevant foreverafter
             # NOTE: if this changes (e.g. in config), persisted cache must be cleared
             def pset(self, v, grp=grp, prop=prop):
                 setattr(self, f'_{prop}', v)
+                expiry, now = self.__dict__.setdefault('_pg_expiry', {}), time.time()
+                if expiry.get(grp, 0) < now: expiry[grp] = now + instance_ttl(getattr(self, f'_get_{grp}'))
+                self.__dict__.setdefault('_pg_loaded', {})[grp] = now
                 getattr(self, f'_set_{grp}')()
 
             def pdel(self, grp=grp, prop=prop):  # invalidate the cache and rebuild on next access
@@ -168,6 +317,24 @@ def propgroups(cl):
 def fix_ytlocal_url(url): return url[1:] if url.startswith('/http') else url
 
 
+def youtube_url(url):
+    '''an absolute url from one extracted by youtube-local: local (`/https://...`), protocol relative, or a youtube path'''
+    url = fix_ytlocal_url(url or '')
+    if url.startswith('//'): return f'https:{url}'
+    return f'https://www.youtube.com{url}' if url.startswith('/') else url
+
+
+SOURCES_EXPIRY_MARGIN = 900  # stop handing out stream urls this long before they expire (a video is watched for a while)
+SOURCES_MIN_TTL = 60
+COMMENTS_ERROR_TTL = 60
+
+
+def url_expiry(urls):
+    '''the earliest `expire` (unix time) among signed youtube urls, less SOURCES_EXPIRY_MARGIN; None if none has one'''
+    expires = [int(e) for url in urls for e in urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('expire', []) if e.isdigit()]
+    return min(expires) - SOURCES_EXPIRY_MARGIN if expires else None
+
+
 BASE_URL = 'https://www.youtube.com'
 
 
@@ -178,12 +345,12 @@ class ytBase(object):
 
 
 ############################### VIDEO ######################################
-@unique_constructor(hash=hash, cache=cache)
+@unique_constructor(hash=hash, cache=IdentityMap('ytVideo', config.identity_map_size, config.identity_map_mb * 2**20))
 @propgroups
 class ytVideo(ytBase):
     __propgroups__ = {'oembed': ['title', 'thumbnail', 'channel_name', 'channel_url'], 'ch_id': ['cid'],
-                      'page': ['published', 'duration', 'is_live', 'description', 'view_count', 'rating', 'rating_count', 'tags', 'related_videos',
-                               'av_sources', 'audio_sources', 'video_sources', 'caption_sources'],
+                      'page': ['published', 'duration', 'is_live', 'description', 'view_count', 'rating', 'rating_count', 'tags', 'related_videos'],
+                      'sources': ['av_sources', 'audio_sources', 'video_sources', 'caption_sources', 'sources_expire'],
                       'from_lists': ['badges'],
                       'ts_human': ['timestamp_human'],
                       'dur_human': ['duration_human'],
@@ -193,9 +360,15 @@ class ytVideo(ytBase):
 
     __prop_mappers__ = {'thumbnail': 'map_image_url', 'channel_avatar': 'map_image_url', 'timestamp_human': 'map_trim_ago', 'description': 'map_markup'}
 
+    # groups whose getters read props of other groups, which a PrefetchPlan loads first
+    __propgroup_deps__ = {'ch_id': ['oembed'], 'ch_avatar': ['ch_id'], 'sources': ['page']}  # the page fetch also caches the sources
+
+    # stream urls are signed and stop working at their `expire`, so instances drop the sources by then
+    __propgroup_expires__ = {'sources': 'sources_expire'}
+
     __invalid_data__ = {'invalid': True, 'title': '__error__', 'thumbnail': '', 'channel_name': '', 'channel_url': '', 'cid': 'NOTFOUND',
                         'published': datetime.datetime.strptime('1970-01-01', '%Y-%m-%d'), 'duration': '--', 'is_live': False, 'description': 'Invalid video ID',
-                        'view_count': 0, 'rating': 0, 'rating_count': 0, 'tags': [], 'related_videos': [], 'av_sources': [], 'audio_sources': [], 'caption_sources': [],
+                        'view_count': 0, 'rating': 0, 'rating_count': 0, 'tags': [], 'related_videos': [], 'av_sources': [], 'audio_sources': [], 'video_sources': [], 'caption_sources': [], 'sources_expire': 0,
                         'badges': [], 'timestamp_human': 'never'}
 
     @cache.memoize(timeout=1)
@@ -204,11 +377,10 @@ class ytVideo(ytBase):
     @fscache.memoize(timeout=86400)
     @logged
     def _get_oembed(self):
-        with FuturesSession() as session:
-            resp = session.get(f"https://www.youtube.com/oembed?format=json&url=http%3A%2F%2Fyoutu.be%2F{self.id}").result()
-            if resp.status_code != 200: return self._return_error('oembed', resp.text)
-            info = json.loads(resp.content)
-            return {'title': info['title'], 'thumbnail': info['thumbnail_url'], 'channel_name': info['author_name'], 'channel_url': info['author_url']}
+        resp = httpclient.api.get(f"https://www.youtube.com/oembed?format=json&url=http%3A%2F%2Fyoutu.be%2F{self.id}")
+        if resp.status_code != 200: return self._return_error('oembed', resp.text, transient=resp.status_code == 429 or resp.status_code >= 500)
+        info = json.loads(resp.content)
+        return {'title': info['title'], 'thumbnail': info['thumbnail_url'], 'channel_name': info['author_name'], 'channel_url': info['author_url']}
 
     @fscache.memoize(timeout=86400 * 7)
     @logged
@@ -218,16 +390,21 @@ class ytVideo(ytBase):
     @logged
     def _get_ch_avatar(self): return {'channel_avatar': ytChannel(self.cid).avatar_unmapped}
 
-    @fscache.memoize(timeout=3600 * 2)
+    @fscache.memoize(timeout=3600)
     @logged
-    def _get_page(self):
+    def _get_sources(self):
+        dead = dead_ids.get('ytVideo', self.id)  # the page just failed, don't count another failure
+        if dead: return expiring({k: self.__invalid_data__[k] for k in self.__propgroups__['sources']}, int(dead['until'] - time.time()) + 1)
         info = youtube.watch.extract_info(self.id, False, playlist_id=None, index=None)
         error = info['playability_error'] or info['error']
-        if error: return self._return_error('page', error)
+        if error: return self._return_error('sources', error)
+        return self._make_sources(info)
 
+    def _make_sources(self, info):
+        '''the sources group from `info`, cached until shortly before the first of its urls expires'''
         def make_video_source(fmt):
             return {
-                'src': prop_mappers['map_stream_url'](fmt['url']),
+                'src': prop_mappers['map_stream_url'](fmt['url'], self.id),
                 'type': f"video/{fmt['ext']}",
                 'label': f'{fmt["ext"]} {fmt["quality"]}P',
                 'quality': fmt['quality'],
@@ -237,7 +414,7 @@ class ytVideo(ytBase):
 
         def make_audio_source(fmt):
             return {
-                'src': prop_mappers['map_stream_url'](fmt['url']),
+                'src': prop_mappers['map_stream_url'](fmt['url'], self.id),
                 'type': f"audio/{fmt['ext']}",
                 'label': f"{fmt['audio_bitrate']}kpbs",
                 'bitrate': fmt['audio_bitrate'],
@@ -260,6 +437,21 @@ class ytVideo(ytBase):
         for caption in caption_sources:
             caption['src'] = prop_mappers['map_image_url'](fix_ytlocal_url(caption['url']))
 
+        expire = url_expiry([fmt['url'] for fmt in formats] + [fix_ytlocal_url(c['url']) for c in caption_sources])
+        sources = {'av_sources': av_sources, 'video_sources': video_sources, 'audio_sources': audio_sources,
+                   'caption_sources': caption_sources, 'sources_expire': expire}
+        if not expire: return sources
+        return expiring(sources, max(int(expire - time.time()), SOURCES_MIN_TTL))
+
+    @fscache.memoize(timeout=86400 * 3)
+    @logged
+    def _get_page(self):
+        info = youtube.watch.extract_info(self.id, False, playlist_id=None, index=None)
+        error = info['playability_error'] or info['error']
+        if error: return self._return_error('page', error)
+        self._revived()
+        self._get_sources.set_cache(self._make_sources(info), self)  # fresh urls come along for free
+
         likes, dislikes, rating = info['like_count'], info['dislike_count'], 50
         votes = likes + dislikes
         if votes > 0: rating = int(likes / (votes) * 100)
@@ -309,10 +501,6 @@ class ytVideo(ytBase):
             'rating_count': votes,
             'tags': info['tags'],
             'related_videos': related,
-            'av_sources': av_sources,
-            'video_sources': video_sources,
-            'audio_sources': audio_sources,
-            'caption_sources': caption_sources,
         }
 
     @property
@@ -339,14 +527,29 @@ class ytVideo(ytBase):
     @cache.memoize(timeout=1)
     def _get_NYI(self): pass
 
-    # TODO
-    def get_comments(self, sort=0, offset=0):
-        comments = youtube.comments.video_comments(self.id, sort=0, offset=0, lc='', secret_key='')
-        if comments is None: return []
-        comments.sort(key=lambda x: x['likes'], reverse=True)
-        for cmnt in comments:
-            cmnt['thumbnail'] = prop_mappers['map_image_url'](cmnt['thumbnail'])
-        return comments
+    def get_comments(self, sort=0, continuation=None):
+        '''a page of comments, sorted by youtube's `sort` (0 top, 1 newest), with avatars mapped, and the continuation token of the
+        next page (None on the last one); the first page without `continuation`'''
+        cpage = self._get_comments_page(sort, continuation)
+        avatars = prop_mappers['map_image_urls']([c['thumbnail'] for c in cpage['comments']])
+        return {'comments': [dict(c, thumbnail=a) for c, a in zip(cpage['comments'], avatars)], 'continuation': cpage['continuation']}
+
+    # cached by continuation token, which the client passes back for the next page; comments are stored parsed, their text as
+    # sanitized html, and avatars unmapped
+    @commentcache.memoize(timeout=config.comment_cache_ttl)
+    @logged
+    def _get_comments_page(self, sort=0, continuation=None):
+        if not continuation: info = youtube.comments.video_comments(self.id, sort=sort, offset=0, lc='', secret_key='')
+        else:
+            try: info = yt_data_extract.extract_comments_info(youtube.comments.request_comments(continuation), ctoken=continuation)
+            except Exception as e: info = {'error': repr(e)}
+        if not info: return {'comments': [], 'continuation': None}  # comments disabled
+        if info.get('error'):
+            return expiring({'comments': [], 'continuation': None, 'error': info['error']}, COMMENTS_ERROR_TTL)
+        comments = [parse_comment(c) for c in info.get('comments', [])]
+        # the first page went through youtube-local's post processing (local urls), the others are as extracted
+        for cmnt in comments: cmnt['channel'], cmnt['thumbnail'] = youtube_url(cmnt['channel']), youtube_url(cmnt['thumbnail'])
+        return {'comments': comments, 'continuation': info.get('ctoken')}
 
 
 # TODO
@@ -354,41 +557,63 @@ class ytComment(object):
     pass
 
 
+ATOM_VALIDATORS_TIMEOUT = 86400 * 7
+
+
 # @fscache.memoize(timeout=3)
-def _get_atom_feed(url):
+def _get_atom_feed(url, src):
+    '''Fetch and parse the atom feed of `src`; the last parsed result is stored with the response validators (ETag / Last-Modified),
+    so that when youtube answers a conditional request with 304 it is returned as is (with 'modified': False) without reparsing.
+    New contents go to the `feed_listeners` first: if one fails, the validators aren't stored, and the next fetch is a full one.'''
     now = utcnow()
     videos = []
-    with FuturesSession() as session:
-        resp = session.get(url).result()
-        if resp.status_code != 200: return None
-        rssFeed = feedparser.parse(resp.content)
-        try: published = dateparse(rssFeed.feed.published)
-        except (AttributeError, ValueError): published = now
-        for entry in rssFeed.entries:
-            video = ytVideo(entry.yt_videoid)
-            video.addprop('duration', '')
-            video.setprop('title', entry.title)
-            video.setprop('thumbnail', entry.media_thumbnail[0]['url'])
-            video.setprop('channel_name', entry.author_detail.name)
-            video.setprop('channel_url', entry.author_detail.href)
-            video.setprop('cid', entry.yt_channelid)
-            # If youtube rss does not have parsed time, generate it. Else set time to 0.
-            try: video.setprop('published', dateparse(entry.published))
-            except ValueError: video.addprop('published', now)
-            # try: video.updated = dateparse(entry.updated)
-            # except (AttributeError, ValueError): video.updated = now
-            video.setprop('description', entry.summary_detail.value)
-            # video.description = re.sub(r'^https?:\/\/.*[\r\n]*', '', video.description[0:120] + "...",
-            #                            flags=re.MULTILINE)
-            video.addprop('view_count', entry.media_statistics['views'])
-            video.addprop('rating', int(float(entry.media_starrating['average']) / float(entry.media_starrating['max']) * 100))
-            videos.append(video)
-    return {'title': rssFeed.feed.title, 'cid': rssFeed.feed.yt_channelid, 'channel_name': rssFeed.feed.author_detail.name, 'channel_url': rssFeed.feed.author_detail.href,
+    key = f'atom_feed:{url}'
+    stored = fscache.get_value(key)
+    headers = {}
+    if stored and stored['etag']: headers['If-None-Match'] = stored['etag']
+    if stored and stored['last_modified']: headers['If-Modified-Since'] = stored['last_modified']
+    resp = httpclient.api.get(url, headers=headers)
+    if resp.status_code == 304 and stored:
+        fscache.set_value(key, stored, timeout=ATOM_VALIDATORS_TIMEOUT)
+        return dict(stored['feed'], modified=False)
+    if resp.status_code != 200: return None
+    rssFeed = feedparser.parse(resp.content)
+    try: published = dateparse(rssFeed.feed.published)
+    except (AttributeError, ValueError): published = now
+    for entry in rssFeed.entries:
+        video = ytVideo(entry.yt_videoid)
+        video.addprop('duration', '')
+        video.setprop('title', entry.title)
+        video.setprop('thumbnail', entry.media_thumbnail[0]['url'])
+        video.setprop('channel_name', entry.author_detail.name)
+        video.setprop('channel_url', entry.author_detail.href)
+        video.setprop('cid', entry.yt_channelid)
+        # If youtube rss does not have parsed time, generate it. Else set time to 0.
+        try: video.setprop('published', dateparse(entry.published))
+        except ValueError: video.addprop('published', now)
+        # try: video.updated = dateparse(entry.updated)
+        # except (AttributeError, ValueError): video.updated = now
+        video.setprop('description', entry.summary_detail.value)
+        # video.description = re.sub(r'^https?:\/\/.*[\r\n]*', '', video.description[0:120] + "...",
+        #                            flags=re.MULTILINE)
+        video.addprop('view_count', entry.media_statistics['views'])
+        video.addprop('rating', int(float(entry.media_starrating['average']) / float(entry.media_starrating['max']) * 100))
+        videos.append(video)
+    feed = {'title': rssFeed.feed.title, 'cid': rssFeed.feed.yt_channelid, 'channel_name': rssFeed.feed.author_detail.name, 'channel_url': rssFeed.feed.author_detail.href,
             'published': published, 'videos': videos}
+    try:
+        for listener in feed_listeners: listener(src, videos)
+    except Exception as e:
+        print(f'.feed listener failed for {url}: {e!r}')
+        fscache.delete(key)
+        return dict(feed, modified=True)
+    etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+    if etag or last_modified: fscache.set_value(key, {'etag': etag, 'last_modified': last_modified, 'feed': feed}, timeout=ATOM_VALIDATORS_TIMEOUT)
+    return dict(feed, modified=True)
 
 
 ############################### CHANNEL ######################################
-@unique_constructor(hash=hash, cache=cache)
+@unique_constructor(hash=hash, cache=IdentityMap('ytChannel', config.identity_map_size, config.identity_map_mb * 2**20))
 @propgroups
 class ytChannel(ytBase):
     __propgroups__ = {'about_page': ['name', 'url', 'avatar', 'sub_count', 'joined', 'description', 'view_count', 'links'],
@@ -425,7 +650,7 @@ class ytChannel(ytBase):
     @fscache.memoize(timeout=3600)
     @logged
     def _get_feed(self):
-        r = _get_atom_feed(f"https://www.youtube.com/feeds/videos.xml?channel_id={self.id}")
+        r = _get_atom_feed(f"https://www.youtube.com/feeds/videos.xml?channel_id={self.id}", self)
         if not r: return self._return_error('feed', 'channel id not found')
         self.addprop('joined', r['published'])
         self.addprop('url', r['channel_url'])
@@ -440,6 +665,7 @@ class ytChannel(ytBase):
         # if info['error'] == 'This channel does not exist': return YT_CHANNEL_INVALID_DATA
         # elif info['error'] is not None: raise RuntimeError(info['error'])
         if info['error']: return self._return_error('about_page', info['error'])
+        self._revived()
 
         joined = dateparse(info['date_joined'])
         # links is a list of tuples (text, url)
@@ -457,11 +683,20 @@ class ytChannel(ytBase):
     def get_videos(self, page=1, sort=3):
         videos = []
         if self.invalid: return videos
+        dead = dead_ids.get('ytChannel', self.id)
+        if dead:
+            self._make_error(dead['error'])
+            return expiring(videos, int(dead['until'] - time.time()) + 1)
         view = 1  # not sure what this this
         polymer = youtube.channel.get_channel_tab(self.id, page, sort, 'videos', view)
         info = youtube.yt_data_extract.extract_channel_info(json.loads(polymer), 'videos')
 
-        if info['error'] is not None: raise RuntimeError(info['error'])  # FIXME error ytVideo obj
+        if info['error'] is not None:
+            metrics.incr('ytChannel.get_videos', 'errors')
+            self._make_error(info['error'])
+            ttl = TRANSIENT_ERROR_TTL if is_transient(info['error']) else dead_ids.failed('ytChannel', self.id, info['error'])
+            return expiring(videos, ttl)
+        self._revived()
 
         for item in info['items']:
             if not item['error'] and item['type'] == 'video':
@@ -506,7 +741,7 @@ def get_cid_for_urlpath(path): return youtube.channel.get_channel_id(f'{BASE_URL
 
 
 ############################### PLAYLIST ######################################
-@unique_constructor(hash=hash, cache=cache)
+@unique_constructor(hash=hash, cache=IdentityMap('ytPlaylist', config.identity_map_size, config.identity_map_mb * 2**20))
 @propgroups
 class ytPlaylist(ytBase):
     __propgroups__ = {'page': ['title', 'thumbnail', 'cid', 'channel_name', 'channel_url', 'num_videos', 'num_video_pages', 'description', 'view_count'],
@@ -516,6 +751,8 @@ class ytPlaylist(ytBase):
 
     __prop_mappers__ = {'thumbnail': 'map_image_url', 'description': 'map_markup'}
 
+    __propgroup_deps__ = {'ch_avatar': ['page']}
+
     __invalid_data__ = {'invalid': True, 'title': '__error__', 'url': '', 'cid': 'NOTFOUND', 'channel_name': '', 'channel_url': '', 'thumbnail': '', 'view_count': 0,
                         'published': datetime.datetime.strptime('1970-01-01', '%Y-%m-%d'), 'description': '--playlist does not exist--',
                         'num_videos': 0, 'num_video_pages': 1, 'recent_videos': []}
@@ -526,7 +763,7 @@ class ytPlaylist(ytBase):
     @fscache.memoize(timeout=3600 * 6)
     @logged
     def _get_feed(self):
-        r = _get_atom_feed(f"https://www.youtube.com/feeds/videos.xml?playlist_id={self.id}")
+        r = _get_atom_feed(f"https://www.youtube.com/feeds/videos.xml?playlist_id={self.id}", self)
         if not r: return self._return_error('feed', 'playlist id not found')
         self.addprop('title', r['title'])
         self.addprop('cid', r['cid'])
@@ -541,6 +778,7 @@ class ytPlaylist(ytBase):
         info = youtube.yt_data_extract.extract_playlist_metadata(polymer)
 
         if info['error']: return self._return_error('page', info['error'])
+        self._revived()
 
         return {'title': info['title'], 'thumbnail': info['thumbnail'],
                 'cid': info['author_id'], 'channel_name': info['author'], 'channel_url': info['author_url'],
@@ -556,11 +794,19 @@ class ytPlaylist(ytBase):
     def get_videos(self, page=1):
         videos = []
         if self.invalid: return videos
+        dead = dead_ids.get('ytPlaylist', self.id)
+        if dead:
+            self._make_error(dead['error'])
+            return expiring(videos, int(dead['until'] - time.time()) + 1)
         polymer = youtube.playlist.get_videos(self.id, page)
         info = youtube.yt_data_extract.extract_playlist_info(polymer)
 
-        if info['error'] is not None: raise RuntimeError(info['error'])
-        if info['error']: return []  # FIXME error ytVideo obj
+        if info['error'] is not None:
+            metrics.incr('ytPlaylist.get_videos', 'errors')
+            self._make_error(info['error'])
+            ttl = TRANSIENT_ERROR_TTL if is_transient(info['error']) else dead_ids.failed('ytPlaylist', self.id, info['error'])
+            return expiring(videos, ttl)
+        self._revived()
 
         for item in info['items']:
             if item['type'] == 'video':
@@ -606,6 +852,7 @@ def _text_segments_string(d):
     return s
 
 
+@instrumented
 def yt_search(query, page=1, sort=0, autocorrect=1):
     filters = {"time": 0, "type": 0, "duration": 0}
     polymer = youtube.search.get_search_json(query, page, autocorrect, sort, filters)
@@ -21,6 +21,12 @@ class DEFAULT_CONFIG:
     proxy_images = True
     proxy_videos = True
     external_proxy = ''
+    fetch_workers = 16
+    http_api_per_host = 10
+    http_proxy_per_host = 100
+    feed_fetch_timeout = 10
+    feed_refresh = False
+    feed_refresh_ratio = 0.8
 
     temp_dir = 'var'
     sqlite_db_file = 'yotter.db'
@@ -29,6 +35,19 @@ class DEFAULT_CONFIG:
     cache_dir = 'var/cache'
     cache_backend = ''
     cache_url = ''
+    cache_max_mb = 1024
+    image_cache_mb = 1024
+    image_formats = ['image/avif', 'image/webp']
+    stream_cache_mb = 0
+    comment_cache_mb = 256
+    comment_cache_ttl = 3600
+    l1_cache_mb = 64
+    l1_cache_ttl = 60
+    identity_map_size = 20000
+    identity_map_mb = 128
+    propgroup_ttls = {}
+    negative_ttl = 900
+    negative_max_ttl = 86400
 
     server_name = ''
     server_location = ''
@@ -0,0 +1,6 @@
+# gunicorn settings, read from the working directory; command line options (eg `-w 4`) take precedence
+
+# gevent workers: a request waiting on youtube (most of all the /stream and /ytimg proxies, which can last as long as a video)
+# only holds a greenlet instead of a whole worker
+worker_class = 'gevent'
+worker_connections = 1000
@@ -0,0 +1,33 @@
+"""unique feed entries
+
+Revision ID: c4d2e3f5a6b7
+Revises: b3f1c2d4e5a6
+Create Date: 2026-10-18 16:40:12.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d2e3f5a6b7'
+down_revision = 'b3f1c2d4e5a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the latest of any duplicates (concurrent merges could insert the same video twice)
+    op.execute('DELETE FROM yt_feed_entry WHERE rowid NOT IN (SELECT keep FROM (SELECT MAX(rowid) AS keep FROM yt_feed_entry '
+               'GROUP BY channel_rowid, playlist_rowid, video_id) AS kept)')
+    op.drop_index('ix_yt_feed_entry_playlist_video', table_name='yt_feed_entry')
+    op.drop_index('ix_yt_feed_entry_channel_video', table_name='yt_feed_entry')
+    op.create_index('ix_yt_feed_entry_channel_video', 'yt_feed_entry', ['channel_rowid', 'video_id'], unique=True)
+    op.create_index('ix_yt_feed_entry_playlist_video', 'yt_feed_entry', ['playlist_rowid', 'video_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_yt_feed_entry_playlist_video', table_name='yt_feed_entry')
+    op.drop_index('ix_yt_feed_entry_channel_video', table_name='yt_feed_entry')
+    op.create_index('ix_yt_feed_entry_channel_video', 'yt_feed_entry', ['channel_rowid', 'video_id'], unique=False)
+    op.create_index('ix_yt_feed_entry_playlist_video', 'yt_feed_entry', ['playlist_rowid', 'video_id'], unique=False)
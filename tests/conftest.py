@@ -0,0 +1,35 @@
+import os
+import tempfile
+import pytest
+
+# the app reads its configuration at import: use the sample one, with everything written to a scratch directory
+_scratch = tempfile.mkdtemp(prefix='yotter-tests-')
+os.environ.setdefault('YOTTER_CONFIG_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'yotter-config.sample.yaml'))
+os.environ.update(YOTTER_TEMP_DIR=_scratch, YOTTER_CACHE_DIR=os.path.join(_scratch, 'cache'),
+                  YOTTER_SQLITE_DB_FILE=os.path.join(_scratch, 'yotter.db'), YOTTER_FEED_REFRESH='false')
+
+
+@pytest.fixture
+def yotter():
+    '''the app package (it needs the requirements and the youtube-local checkout), in an app context, with empty tables and caches'''
+    yotter = pytest.importorskip('app')
+    from app.youtubeng import ytVideo, ytChannel, ytPlaylist
+    with yotter.app.app_context():
+        yotter.db.create_all()
+        for c in (yotter.cache, yotter.fscache, yotter.commentcache): c.clear()
+        for cls in (ytVideo, ytChannel, ytPlaylist): cls.__identity_map__.clear()
+        yield yotter
+        yotter.db.session.remove()
+        yotter.db.drop_all()
+
+
+@pytest.fixture
+def client(yotter):
+    '''a test client, logged in'''
+    from app.models import User
+    user = User(username='someone')
+    yotter.db.session.add(user)
+    yotter.db.session.commit()
+    client = yotter.app.test_client()
+    with client.session_transaction() as session: session.update(_user_id=str(user.rowid), _fresh=True)
+    return client
@@ -0,0 +1,176 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+flask = pytest.importorskip('flask')
+caching = pytest.importorskip('app.caching')  # imports the app, so needs its requirements
+from app.serialization import payloads  # noqa: E402
+
+
+@pytest.fixture(params=['simple', 'sqlite'])
+def keycache(request, tmp_path):
+    '''a local (in-process) KeyCache, and one shared between processes through an SQLite file, with an L1'''
+    app = flask.Flask(__name__)
+    if request.param == 'simple': config = {'CACHE_TYPE': 'simple', 'CACHE_DEFAULT_TIMEOUT': 60}
+    else: config = dict(caching.sqlite_cache_config(str(tmp_path / 'cache.sqlite'), 1), CACHE_DEFAULT_TIMEOUT=60)
+    cache = caching.KeyCache(app, config=config, serializer=payloads, l1=caching.LRUCache('test', 2**20, 60))
+    with app.app_context(): yield cache
+
+
+def counted(keycache, **options):
+    calls = []
+
+    @keycache.memoize(**options)
+    def double(x):
+        calls.append(x)
+        return x * 2
+    return double, calls
+
+
+def test_l1_only_for_shared_backends(keycache):
+    assert (keycache.l1 is not None) == keycache.shared
+
+
+def test_memoize(keycache):
+    double, calls = counted(keycache, timeout=60)
+    assert [double(2), double(2), double(3)] == [4, 4, 6]
+    assert calls == [2, 3]
+
+
+def test_set_and_del_cache(keycache):
+    double, calls = counted(keycache, timeout=60)
+    double.set_cache(5, 2)
+    assert double(2) == 5 and calls == []
+    double.del_cache(2)
+    assert double(2) == 4 and calls == [2]
+
+
+def test_purge(keycache):
+    double, calls = counted(keycache, timeout=60)
+    double(2), double(3)
+    double.purge()
+    double(2), double(3)
+    assert calls == [2, 3, 2, 3]
+    assert keycache.purge_memoized(double.__qualname__) == 1
+    double(2)
+    assert calls[-1] == 2 and len(calls) == 5
+
+
+def test_cache_config(monkeypatch):
+    local = {'CACHE_TYPE': 'simple', 'CACHE_DEFAULT_TIMEOUT': 60}
+    assert caching.cache_config('yotter:', local) is local
+
+    def configured(backend, url=''):
+        monkeypatch.setattr(caching, 'config', caching.config._replace(cache_backend=backend, cache_url=url))
+        return caching.cache_config('yotter:', local)
+    assert configured('redis', 'redis://localhost:6379/0') == {'CACHE_TYPE': 'redis', 'CACHE_KEY_PREFIX': 'yotter:', 'CACHE_DEFAULT_TIMEOUT': 60,
+                                                               'CACHE_REDIS_URL': 'redis://localhost:6379/0'}
+    assert configured('memcached', 'a:11211,b:11211')['CACHE_MEMCACHED_SERVERS'] == ['a:11211', 'b:11211']
+    with pytest.raises(ValueError): configured('mongodb')
+
+
+def test_round_trip_through_the_backend(keycache):
+    value = {'when': caching.time.time(), 'items': [1, (2, 3)], '$t': 'a payload key'}
+
+    @keycache.memoize(timeout=60)
+    def payload(): return value
+    assert payload() == value
+    if keycache.l1: keycache.l1.clear()
+    assert payload() == value  # decoded from the backend
+
+
+def test_stale_while_revalidate(keycache):
+    double, calls = counted(keycache, timeout=60, soft_timeout=0.01)
+    double(2)
+    time.sleep(0.02)
+    assert double(2) == 4  # served stale, refreshed in the background
+    deadline = time.time() + 5
+    while len(calls) < 2 and time.time() < deadline: time.sleep(0.01)
+    assert calls == [2, 2]
+
+
+def test_expiring_values_keep_their_timeout(keycache):
+    @keycache.memoize(timeout=60)
+    def short(): return caching.expiring({'a': 1}, 5)
+    short()
+    entry = keycache._lookup(short.make_cache_key(), 60)
+    assert entry.value == {'a': 1} and entry.timeout == 5
+
+
+def test_single_flight(keycache):
+    calls, started, release = [], threading.Event(), threading.Event()
+
+    @keycache.memoize(timeout=60)
+    def slow(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * 2
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(slow, 2)
+        started.wait(5)
+        others = [pool.submit(slow, 2) for _ in range(3)]
+        release.set()
+        assert [f.result(5) for f in [first] + others] == [4] * 4
+    assert calls == [2]
+
+
+def test_shared_flight_taken_over_once_the_lock_is_gone(keycache):
+    if not keycache.shared: pytest.skip('only shared backends lock across processes')
+    double, calls = counted(keycache, timeout=60)
+    lock_key = f'{double.make_cache_key(2)}.lock'
+    keycache.cache.add(lock_key, 1, timeout=60)  # another process's fetch, which fails without storing a value
+    threading.Timer(0.2, keycache.cache.delete, [lock_key]).start()
+    started = time.time()
+    assert double(2) == 4 and calls == [2]
+    assert time.time() - started < 5  # not the whole flight timeout
+    assert not keycache.cache.has(lock_key)
+
+
+def test_lru_cache_eviction_and_expiry():
+    lru = caching.LRUCache('test', 100, 60)
+    for i in range(5): lru.set(f'k{i}', i, 30, time.time() + 60)
+    assert lru.get('k0') is None and lru.get('k1') is None
+    assert [lru.get(f'k{i}') for i in range(2, 5)] == [2, 3, 4]
+    lru.set('old', 1, 1, time.time() - 1)
+    assert lru.get('old') is None
+    lru.delete_prefix('k')
+    assert lru.stats()['entries'] == 1 and lru.stats()['bytes'] == 1
+
+
+@pytest.fixture
+def dead_ids(keycache): return caching.NegativeCache(keycache, 'dead', 10, 40)
+
+
+def test_negative_cache_backoff(dead_ids):
+    assert dead_ids.get('ytVideo', 'x') is None
+    assert [dead_ids.failed('ytVideo', 'x', 'gone') for _ in range(4)] == [10, 20, 40, 40]
+    entry = dead_ids.get('ytVideo', 'x')
+    assert entry['failures'] == 4 and entry['error'] == 'gone'
+    assert dead_ids.get('ytChannel', 'x') is None
+    assert set(dead_ids.get_many('ytVideo', ['x', 'y'])) == {'x'}
+
+
+def test_negative_cache_revived(dead_ids):
+    dead_ids.failed('ytVideo', 'x', 'gone')
+    dead_ids.revived('ytVideo', 'x')
+    assert dead_ids.get('ytVideo', 'x') is None
+    assert dead_ids.failed('ytVideo', 'x', 'gone') == 10  # starts over
+    dead_ids.revived('ytVideo', 'never failed')
+
+
+def test_negative_cache_retry_after_ttl(dead_ids, monkeypatch):
+    dead_ids.failed('ytVideo', 'x', 'gone')
+    now = time.time()
+    monkeypatch.setattr(caching.time, 'time', lambda: now + 11)
+    assert dead_ids.get('ytVideo', 'x') is None  # due for a retry, failures still counted
+    assert dead_ids.failed('ytVideo', 'x', 'gone') == 20
+
+
+def test_purge_stamps(keycache):
+    stamps, other = caching.PurgeStamps(keycache, 'purged', 0), caching.PurgeStamps(keycache, 'purged', 0)
+    assert other.get('ytVideo') == 0
+    stamps.purged('ytVideo')
+    assert other.get('ytVideo') == stamps.get('ytVideo') > 0
+    assert other.get('ytChannel') == 0
@@ -0,0 +1,79 @@
+import pytest
+
+
+@pytest.fixture
+def youtubeng(yotter):
+    from app import youtubeng
+    return youtubeng
+
+
+def raw_comment(text, author='someone'):
+    '''a comment as extracted by youtube-local'''
+    return {'author': author, 'author_avatar': '//yt3.ggpht.com/a', 'author_url': '/channel/UCb', 'text': [{'text': text}],
+            'time_published': '1 day ago', 'like_count': 3, 'reply_count': 1}
+
+
+@pytest.fixture
+def upstream(youtubeng, monkeypatch):
+    '''youtube-local's comment fetches: a first page, then the one behind the token "page2"; records the pages fetched'''
+    fetched = []
+
+    def video_comments(vid, sort=0, offset=0, lc='', secret_key=''):
+        fetched.append((vid, sort, None))
+        return {'comments': [raw_comment('first <b>page</b> https://example.com')], 'ctoken': 'page2'}
+
+    def extract_comments_info(polymer_json, ctoken=None):
+        fetched.append(polymer_json)
+        return {'comments': [raw_comment('second page')], 'ctoken': None}
+    monkeypatch.setattr(youtubeng.youtube.comments, 'video_comments', video_comments, raising=False)
+    monkeypatch.setattr(youtubeng.youtube.comments, 'request_comments', lambda ctoken: ('page', ctoken), raising=False)
+    monkeypatch.setattr(youtubeng.yt_data_extract, 'extract_comments_info', extract_comments_info, raising=False)
+    monkeypatch.setitem(youtubeng.prop_mappers, 'map_image_urls', lambda urls: [f'/ytimg/{url}' for url in urls])
+    return fetched
+
+
+def test_youtube_url(youtubeng):
+    assert youtubeng.youtube_url('/https://yt3.ggpht.com/a') == 'https://yt3.ggpht.com/a'
+    assert youtubeng.youtube_url('//yt3.ggpht.com/a') == 'https://yt3.ggpht.com/a'
+    assert youtubeng.youtube_url('/channel/UCb') == 'https://www.youtube.com/channel/UCb'
+    assert youtubeng.youtube_url('https://example.com/') == 'https://example.com/'
+    assert youtubeng.youtube_url(None) == ''
+
+
+def test_parse_comment_sanitizes(yotter):
+    from app.utils import parse_comment
+    comment = parse_comment(raw_comment('<script>alert(1)</script>\nsee https://example.com'))
+    assert type(comment['text']) is str  # cacheable
+    assert '<script>' not in comment['text'] and '&lt;script&gt;' in comment['text'] and '<br>' in comment['text']
+    assert '<a href="https://example.com"' in comment['text']
+    assert (comment['likes'], comment['replies'], comment['creatorHeart']) == (3, 1, False)
+
+
+def test_comments_follow_continuations(youtubeng, upstream):
+    video = youtubeng.ytVideo('aaaaaaaaaaa')
+    first = video.get_comments()
+    assert first['continuation'] == 'page2' and len(first['comments']) == 1
+    comment = first['comments'][0]
+    assert comment['thumbnail'] == '/ytimg/https://yt3.ggpht.com/a' and comment['channel'] == 'https://www.youtube.com/channel/UCb'
+    second = video.get_comments(continuation='page2')
+    assert second['continuation'] is None and 'second page' in second['comments'][0]['text']
+    assert upstream == [('aaaaaaaaaaa', 0, None), ('page', 'page2')]
+
+
+def test_comment_pages_are_cached(youtubeng, upstream):
+    video = youtubeng.ytVideo('aaaaaaaaaaa')
+    video.get_comments(), video.get_comments(continuation='page2')
+    video.get_comments(), video.get_comments(continuation='page2')
+    assert len(upstream) == 2
+    video.get_comments(sort=1)  # another order, another first page
+    assert upstream[-1] == ('aaaaaaaaaaa', 1, None)
+
+
+def test_comment_errors(youtubeng, upstream, monkeypatch):
+    monkeypatch.setattr(youtubeng.youtube.comments, 'request_comments', lambda ctoken: 1 / 0)
+    page = youtubeng.ytVideo._get_comments_page.uncached(youtubeng.ytVideo('aaaaaaaaaaa'), 0, 'expired')
+    assert page['comments'] == [] and page['continuation'] is None and 'ZeroDivisionError' in page['error']
+    assert page.cache_timeout == youtubeng.COMMENTS_ERROR_TTL  # not cached for as long as the comments
+
+    monkeypatch.setattr(youtubeng.youtube.comments, 'video_comments', lambda *args, **kwargs: {})  # comments disabled
+    assert youtubeng.ytVideo('bbbbbbbbbbb').get_comments() == {'comments': [], 'continuation': None}
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+@pytest.fixture
+def models(yotter):
+    from app import models
+    return models
+
+
+@pytest.fixture
+def user(yotter, models):
+    user = models.User(username='someone')
+    yotter.db.session.add(user)
+    yotter.db.session.commit()
+    return user
+
+
+def feed_video(models, vid, cid, published, title=None):
+    '''a video as parsed from an atom feed'''
+    video = models.ytVideo(vid)
+    video.setprop('title', title or f'video {vid}')
+    video.setprop('thumbnail', f'https://i.ytimg.com/vi/{vid}/hqdefault.jpg')
+    video.setprop('channel_name', f'channel {cid}')
+    video.setprop('cid', cid)
+    video.setprop('published', published)
+    video.addprop('view_count', 10)
+    return video
+
+
+def subscribe(yotter, user, cid):
+    user.yt_subscribed_channel_ids.add(cid)
+    yotter.db.session.commit()
+
+
+def test_merge_and_read_back(yotter, models, user):
+    subscribe(yotter, user, 'UCa')
+    now = datetime.now(timezone.utc)
+    videos = [feed_video(models, f'v{i}', 'UCa', now - timedelta(hours=i)) for i in range(3)]
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), videos)
+    entries, cursor = models.dbFeedEntry.latest_for_user(user)
+    assert [e.video_id for e in entries] == ['v0', 'v1', 'v2']
+    assert cursor is None
+    video = entries[0].to_video()
+    assert video.title == 'video v0' and video.channel_name == 'channel UCa' and video.view_count == 10
+
+
+def test_merge_updates_existing_entries(yotter, models, user):
+    subscribe(yotter, user, 'UCa')
+    now = datetime.now(timezone.utc)
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, 'v0', 'UCa', now)])
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, 'v0', 'UCa', now, title='renamed')])
+    entries, _ = models.dbFeedEntry.latest_for_user(user)
+    assert [(e.video_id, e.title) for e in entries] == [('v0', 'renamed')]
+
+
+def test_merge_keeps_the_request_session_alone(yotter, models, user):
+    subscribe(yotter, user, 'UCa')
+    user.is_admin = True  # pending in the request's session
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, 'v0', 'UCa', datetime.now(timezone.utc))])
+    yotter.db.session.rollback()
+    assert not yotter.db.session.get(models.User, user.rowid).is_admin
+
+
+def test_merge_skips_unknown_sources(yotter, models, user):
+    models.dbFeedEntry.merge(models.ytChannel('UCunknown'), [feed_video(models, 'v0', 'UCunknown', datetime.now(timezone.utc))])
+    assert models.dbFeedEntry.query.count() == 0
+
+
+def test_same_video_from_a_channel_and_a_playlist(yotter, models, user):
+    subscribe(yotter, user, 'UCa')
+    user.yt_followed_playlist_ids.add('PLa')
+    yotter.db.session.commit()
+    now = datetime.now(timezone.utc)
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, 'v0', 'UCa', now), feed_video(models, 'v1', 'UCa', now - timedelta(hours=1))])
+    models.dbFeedEntry.merge(models.ytPlaylist('PLa'), [feed_video(models, 'v0', 'UCa', now)])
+    entries, cursor = models.dbFeedEntry.latest_for_user(user, limit=2)
+    assert [e.video_id for e in entries] == ['v0', 'v1']  # deduplicated before the limit
+
+
+ATOM_FEED = '''<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">
+ <yt:channelId>UCa</yt:channelId>
+ <title>channel UCa</title>
+ <author><name>channel UCa</name><uri>https://www.youtube.com/channel/UCa</uri></author>
+ <published>2015-01-01T00:00:00+00:00</published>
+ <entry>
+  <yt:videoId>v0</yt:videoId>
+  <yt:channelId>UCa</yt:channelId>
+  <title>video v0</title>
+  <author><name>channel UCa</name><uri>https://www.youtube.com/channel/UCa</uri></author>
+  <published>2026-10-01T12:00:00+00:00</published>
+  <media:group>
+   <media:title>video v0</media:title>
+   <media:thumbnail url="https://i1.ytimg.com/vi/v0/hqdefault.jpg" width="480" height="360"/>
+   <media:description>about v0</media:description>
+   <media:community>
+    <media:starRating count="10" average="4.50" min="1" max="5"/>
+    <media:statistics views="1234"/>
+   </media:community>
+  </media:group>
+ </entry>
+</feed>'''
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b'', headers=None): self.status_code, self.content, self.headers = status_code, content, headers or {}
+
+
+@pytest.fixture
+def upstream(yotter, monkeypatch):
+    '''youtube serving ATOM_FEED with an ETag, and 304 to requests that have it'''
+    requests = []
+
+    def get(url, headers=None, **kwargs):
+        requests.append(headers or {})
+        if (headers or {}).get('If-None-Match') == '"1"': return FakeResponse(304)
+        return FakeResponse(200, ATOM_FEED.encode(), {'ETag': '"1"'})
+    monkeypatch.setattr(yotter.httpclient.api, 'get', get)
+    return requests
+
+
+def test_feed_fetch_merges_entries(yotter, models, user, upstream):
+    subscribe(yotter, user, 'UCa')
+    assert [v.id for v in models.ytChannel('UCa')._get_feed()['recent_videos']] == ['v0']
+    entries, _ = models.dbFeedEntry.latest_for_user(user)
+    assert [(e.video_id, e.view_count) for e in entries] == [('v0', 1234)]
+
+
+def test_failed_merge_refetches_the_whole_feed(yotter, models, user, upstream, monkeypatch):
+    from app import youtubeng
+    subscribe(yotter, user, 'UCa')
+    url = 'https://www.youtube.com/feeds/videos.xml?channel_id=UCa'
+
+    def locked(src, videos): raise RuntimeError('database is locked')
+    monkeypatch.setattr(youtubeng, 'feed_listeners', [locked])
+    youtubeng._get_atom_feed(url, models.ytChannel('UCa'))
+    monkeypatch.setattr(youtubeng, 'feed_listeners', [models.dbFeedEntry.merge])
+    youtubeng._get_atom_feed(url, models.ytChannel('UCa'))
+    assert 'If-None-Match' not in upstream[1]  # not conditional: the first result was never merged
+    assert [e.video_id for e in models.dbFeedEntry.latest_for_user(user)[0]] == ['v0']
+    assert youtubeng._get_atom_feed(url, models.ytChannel('UCa'))['modified'] is False
+
+
+def test_paging_through_entries_published_together(yotter, models, user):
+    subscribe(yotter, user, 'UCa')
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # feeds only have second precision: whole pages of videos published the same second
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, f'v{i}', 'UCa', now - timedelta(seconds=i // 20)) for i in range(60)])
+    seen, before = [], None
+    while True:
+        entries, cursor = models.dbFeedEntry.latest_for_user(user, limit=7, before=before)
+        seen += [e.video_id for e in entries]
+        if cursor is None: break
+        before = models.dbFeedEntry.parse_cursor(cursor)
+    assert sorted(seen) == sorted(f'v{i}' for i in range(60)) and len(seen) == 60
+
+
+def test_bad_cursors(models):
+    for cursor in ('', '123', 'a_b', '1_2_3'):
+        with pytest.raises(ValueError): models.dbFeedEntry.parse_cursor(cursor)
+
+
+def test_feed_pages(yotter, models, client):
+    import re
+    user = models.User.query.filter_by(username='someone').one()
+    subscribe(yotter, user, 'UCa')
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    models.dbFeedEntry.merge(models.ytChannel('UCa'), [feed_video(models, f'v{i:02}', 'UCa', now - timedelta(seconds=i // 20)) for i in range(60)])
+    first, _ = models.dbFeedEntry.latest_for_user(user, limit=1)
+    seen, url = [], f'/feed?before={first[0].cursor}'  # older pages come from the table alone
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        seen += re.findall(r'>video (v\d+)<', html)
+        url = next(iter(re.findall(r'href="(/feed\?before=[^"]+)"', html)), None)
+    assert sorted(seen) == sorted(f'v{i:02}' for i in range(60) if f'v{i:02}' != first[0].video_id)
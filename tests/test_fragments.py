@@ -0,0 +1,74 @@
+import json
+from datetime import datetime, timezone
+import pytest
+
+XHR = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+def video(vid, title, cid='UCa', related=()):
+    '''a ytVideo with its page (and oembed) loaded'''
+    from app.youtubeng import ytVideo
+    v = ytVideo(vid)
+    props = dict(title=title, thumbnail=f'https://i.ytimg.com/vi/{vid}/hqdefault.jpg', channel_name=f'channel {cid}', cid=cid,
+                 channel_url=f'https://www.youtube.com/channel/{cid}', published=datetime.now(timezone.utc), duration=60, is_live=False,
+                 description='', view_count=10, rating=5, rating_count=1, tags=[], related_videos=list(related))
+    for k, val in props.items(): v.setprop(k, val)
+    return v
+
+
+@pytest.fixture
+def videos(yotter):
+    return video('aaaaaaaaaaa', 'The video', related=[video('bbbbbbbbbbb', 'Related one'), video('ccccccccccc', 'Related two')])
+
+
+@pytest.fixture
+def comments(yotter, monkeypatch):
+    '''two pages of comments, the second behind the continuation token "page2"'''
+    from app.youtubeng import ytVideo
+    comment = dict(author='someone', channel='/channel/UCb', date='1 day ago', replies=0, likes=1, thumbnail='https://yt3.ggpht.com/a')
+    pages = {None: {'comments': [dict(comment, text='first!')], 'continuation': 'page2'},
+             'page2': {'comments': [dict(comment, text='second')], 'continuation': None}}
+    monkeypatch.setattr(ytVideo, '_get_comments_page', lambda self, sort, continuation: pages[continuation])
+    return pages
+
+
+def test_related_fragment(client, videos):
+    resp = client.get('/_frag/related/aaaaaaaaaaa', headers=XHR)
+    html = resp.get_data(as_text=True)
+    assert resp.status_code == 200 and 'X-Requested-With' in resp.headers['Vary']
+    assert 'Related one' in html and 'Related two' in html and '<html' not in html
+
+
+def test_related_fragment_without_javascript(client, videos):
+    html = client.get('/_frag/related/aaaaaaaaaaa').get_data(as_text=True)
+    assert '<html' in html and 'The video' in html and 'Related one' in html  # in the layout, for the noscript links
+
+
+def test_related_fragment_json(client, videos):
+    data = json.loads(client.get('/_frag/related/aaaaaaaaaaa.json').get_data())
+    assert [v['title'] for v in data['videos']] == ['Related one', 'Related two']
+
+
+def test_comments_fragment_pages(client, videos, comments):
+    html = client.get('/_frag/comments/aaaaaaaaaaa', headers=XHR).get_data(as_text=True)
+    assert 'first!' in html and 'ct=page2' in html
+    html = client.get('/_frag/comments/aaaaaaaaaaa?ct=page2', headers=XHR).get_data(as_text=True)
+    assert 'second' in html and 'More comments' not in html
+    data = json.loads(client.get('/_frag/comments/aaaaaaaaaaa.json').get_data())
+    assert [c['text'] for c in data['comments']] == ['first!'] and 'ct=page2' in data['next']
+
+
+def test_comments_fragment_rejects_bad_tokens(client, videos, comments):
+    assert client.get('/_frag/comments/aaaaaaaaaaa?ct=<script>', headers=XHR).status_code == 400
+
+
+def test_fragments_of_hidden_videos(yotter, client, videos, comments):
+    from app.youtubeng import ytChannel
+    ytChannel('UCa').is_blocked = True
+    yotter.db.session.commit()
+    assert 'Related one' not in client.get('/_frag/related/aaaaaaaaaaa', headers=XHR).get_data(as_text=True)
+    assert json.loads(client.get('/_frag/comments/aaaaaaaaaaa.json').get_data()) == {'comments': [], 'next': None}
+
+
+def test_fragments_need_a_login(yotter, videos):
+    assert yotter.app.test_client().get('/_frag/related/aaaaaaaaaaa', headers=XHR).status_code == 302
@@ -0,0 +1,44 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+httpclient = pytest.importorskip('app.httpclient')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        body = (self.headers.get('Cookie') or '-').encode()
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'CONSENT=YES+; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused_and_counted(server):
+    client = httpclient.Client('test', per_host=2, timeout=5)
+    for _ in range(3): assert client.get(f'{server}/').status_code == 200
+    (host,) = client.stats()['hosts']
+    assert (host['host'], host['requests'], host['opened'], host['connections'], host['waiting'], host['max']) == ('127.0.0.1', 3, 1, 1, 0, 2)
+    client.close()
+    assert client.stats()['hosts'][0]['connections'] == 0
+
+
+def test_no_cookies_are_kept(server):
+    client = httpclient.Client('test', per_host=2, timeout=5)
+    client.get(f'{server}/')
+    assert client.get(f'{server}/').text == '-'  # shared by all users: upstream cookies aren't sent back
+    assert len(client.cookies) == 0
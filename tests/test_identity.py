@@ -0,0 +1,46 @@
+import pytest
+
+
+@pytest.fixture
+def models(yotter):
+    from app import models
+    return models
+
+
+def test_setting_a_column_of_a_new_id_saves_it(yotter, models):
+    models.ytChannel('UCnew').is_blocked = True
+    yotter.db.session.remove()
+    assert models.dbChannel.query.filter_by(id='UCnew').one().is_blocked
+    assert models.ytChannel('UCnew').is_blocked
+
+
+def test_reading_a_new_id_doesnt_save_it(yotter, models):
+    assert not models.ytChannel('UCnew').is_blocked
+    yotter.db.session.commit()
+    assert models.dbChannel.query.filter_by(id='UCnew').count() == 0
+
+
+def test_db_objects_are_per_session(yotter, models):
+    channel = models.ytChannel('UCa')
+    channel.is_allowed = True
+    first = channel.db_obj
+    assert channel.db_obj is first
+    yotter.db.session.remove()  # the end of the request
+    assert channel.db_obj is not first and channel.db_obj.is_allowed
+
+
+def test_instances_are_unique(yotter, models):
+    assert models.ytVideo('dQw4w9WgXcQ') is models.ytVideo('dQw4w9WgXcQ')
+    assert models.ytVideo('dQw4w9WgXcQ') is not models.ytVideo('jNQXAC9IVRw')
+
+
+def test_identity_map_bounds():
+    caching = pytest.importorskip('app.caching')
+    objs = caching.IdentityMap('test', max_entries=3, max_bytes=2**20)
+    for i in range(5): objs.set(i, object())
+    assert [objs.get(i) is not None for i in range(5)] == [False, False, True, True, True]
+    small = caching.IdentityMap('test', max_entries=100, max_bytes=1)
+    small.set('a', object())
+    small.set('b', object())
+    assert small.get('a') is None and small.get('b') is not None  # the last one is always kept
+    assert small.stats()['evictions'] == 1
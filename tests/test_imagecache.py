@@ -0,0 +1,111 @@
+import io
+import os
+import pytest
+
+imagecache = pytest.importorskip('app.imagecache')  # imports the app, so needs its requirements
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b'', headers=None, url='https://i.ytimg.com/x.jpg'):
+        self.status_code, self.content, self.headers, self.url = status_code, content, headers or {}, url
+
+
+class FakeUpstream(object):
+    def __init__(self, *responses): self.responses, self.requests = list(responses), []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append((url, headers))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def images(tmp_path):
+    return imagecache.ImageCache(str(tmp_path / 'images'), max_bytes=2**20, revalidate=3600)
+
+
+def files(images):
+    return sorted(name for _, _, names in os.walk(images.path) for name in names if not name.startswith('index.sqlite'))
+
+
+def test_put_get_round_trip(images):
+    img = images.put('https://i.ytimg.com/a.jpg', b'data', 'image/jpeg', etag='"e"')
+    cached = images.get('https://i.ytimg.com/a.jpg')
+    assert cached == img._replace(accessed=cached.accessed)
+    with open(images.file(cached.digest), 'rb') as f: assert f.read() == b'data'
+
+
+def test_files_are_content_addressed(images):
+    images.put('a', b'same', 'image/jpeg')
+    images.put('b', b'same', 'image/jpeg')
+    assert len(files(images)) == 1
+    assert images.stats()['entries'] == 2 and images.stats()['files'] == 1
+
+
+def test_changed_content_removes_the_old_file(images):
+    old = images.put('a', b'old', 'image/jpeg')
+    images.put('a', b'new', 'image/jpeg')
+    assert not os.path.exists(images.file(old.digest))
+    shared = images.put('b', b'shared', 'image/jpeg')
+    images.put('c', b'shared', 'image/jpeg')
+    images.put('b', b'other', 'image/jpeg')
+    assert os.path.exists(images.file(shared.digest))  # still used by 'c'
+
+
+def test_prune_evicts_least_recently_used(images):
+    images.max_bytes = 3000
+    for i in range(5): images.put(f'k{i}', bytes([i]) * 1000, 'image/jpeg')
+    images._prune()
+    assert images.stats()['bytes'] <= images.max_bytes
+    assert images.get('k0') is None and images.get('k4') is not None
+    assert len(files(images)) == images.stats()['files']
+
+
+def test_fetch_revalidates(images, monkeypatch):
+    upstream = FakeUpstream(FakeResponse(200, b'img', {'Content-Type': 'image/webp', 'ETag': '"1"'}), FakeResponse(304))
+    monkeypatch.setattr(imagecache.httpclient, 'proxy', upstream)
+    img = images.fetch('https://i.ytimg.com/x.jpg')
+    assert img.content_type == 'image/webp'
+    assert images.fetch('https://i.ytimg.com/x.jpg').digest == img.digest  # fresh: not fetched again
+    images.revalidate = 0
+    assert images.fetch('https://i.ytimg.com/x.jpg').digest == img.digest
+    assert upstream.requests[-1][1] == {'If-None-Match': '"1"'}
+    assert len(upstream.requests) == 2
+
+
+def test_fetch_error(images, monkeypatch):
+    monkeypatch.setattr(imagecache.httpclient, 'proxy', FakeUpstream(FakeResponse(404, b'not found')))
+    with pytest.raises(imagecache.ImageFetchError): images.fetch('https://i.ytimg.com/x.jpg')
+
+
+def test_variant_resizes(images):
+    Image = pytest.importorskip('PIL.Image')
+    out = io.BytesIO()
+    Image.new('RGB', (640, 360), (200, 10, 10)).save(out, 'PNG')
+    img = images.put('a', out.getvalue(), 'image/png')
+    variant = images.variant(img, width=160)
+    with Image.open(images.file(variant.digest)) as im: assert im.size == (160, 90)
+    assert images.variant(img, width=160).digest == variant.digest  # made once
+    assert variant.size < img.size
+
+
+def test_variant_of_a_broken_image_is_the_original(images):
+    pytest.importorskip('PIL.Image')
+    img = images.put('a', b'not an image', 'image/jpeg')
+    assert images.variant(img, width=160).digest == img.digest
+
+
+def test_variant_transcodes(images):
+    Image = pytest.importorskip('PIL.Image')
+    if 'image/webp' not in imagecache.transcodable: pytest.skip('no webp encoder')
+    out = io.BytesIO()
+    Image.new('RGB', (640, 360), (200, 10, 10)).save(out, 'PNG')
+    img = images.put('a', out.getvalue(), 'image/png')
+    variant = images.variant(img, mimetype='image/webp')
+    assert variant.content_type == 'image/webp' and variant.size < img.size
+
+
+def test_image_format_negotiation(yotter):
+    from app import routes
+    for accept, expected in (('image/avif,image/webp,*/*', 'image/avif'), ('image/webp,*/*', 'image/webp'), ('*/*', None)):
+        with yotter.app.test_request_context('/ytimg/x', headers={'Accept': accept}):
+            assert routes.image_format() == (expected if expected in imagecache.transcodable else None)
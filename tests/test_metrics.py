@@ -0,0 +1,59 @@
+import pytest
+
+
+@pytest.fixture
+def workers(yotter):
+    '''two processes' metrics, publishing to the app's cache'''
+    from app.metrics import Metrics
+    workers = Metrics(), Metrics()
+    workers[0].worker, workers[1].worker = 'host:1', 'host:2'
+    return workers
+
+
+def test_counters_and_latencies():
+    from app.metrics import Metrics, timed
+    m = Metrics()
+    m.incr('f', 'hits', 3)
+    m.incr('f', 'misses')
+    m.observe('f', 0.2)
+    m.observe('f', 20, error=True)
+    f = m.snapshot()['fetchers']['f']
+    assert (f['hits'], f['misses'], f['calls'], f['errors']) == (3, 1, 2, 1)
+    assert f['hit_ratio'] == 0.75 and f['avg_seconds'] == pytest.approx(10.1)
+    assert f['histogram'] == [0, 0, 1, 0, 0, 0, 0, 0, 1]
+
+    from app import metrics as module
+    module.metrics.reset()
+    with pytest.raises(ZeroDivisionError): timed('g', lambda: 1 / 0)()
+    assert module.metrics.snapshot()['fetchers']['g']['errors'] == 1
+
+
+def test_gather_sums_the_workers(yotter, workers):
+    a, b = workers
+    a.incr('f', 'hits', 2)
+    b.incr('f', 'hits', 3)
+    b.incr('g', 'misses')
+    b.publish(yotter.cache, force=True)
+    total = a.gather(yotter.cache)
+    assert total['workers'] == 2
+    assert total['fetchers']['f']['hits'] == 5 and total['fetchers']['g']['misses'] == 1
+
+
+def test_publish_is_throttled(yotter, workers):
+    a, b = workers
+    b.publish(yotter.cache, force=True)
+    b.incr('f', 'hits')
+    b.publish(yotter.cache)  # within PUBLISH_INTERVAL: not published
+    assert 'f' not in a.gather(yotter.cache)['fetchers']
+
+
+def test_reset_all(yotter, workers):
+    a, b = workers
+    a.incr('f', 'hits')
+    b.incr('f', 'hits')
+    b.publish(yotter.cache, force=True)
+    a.reset_all(yotter.cache)
+    assert a.gather(yotter.cache)['workers'] == 1  # b's snapshot predates the reset
+    b.publish(yotter.cache, force=True)  # and b resets as it next publishes
+    total = a.gather(yotter.cache)
+    assert total['workers'] == 2 and 'f' not in total['fetchers']
@@ -0,0 +1,126 @@
+import threading
+import time
+import pytest
+
+
+@pytest.fixture
+def planned(yotter):
+    '''a propgroups class whose getters record their calls; `b` reads `a`, like ytVideo's ch_id reads the oembed'''
+    from app.youtubeng import propgroups, ytBase
+    calls, gate = [], threading.Event()
+    gate.set()
+
+    @propgroups
+    class Planned(ytBase):
+        __propgroups__ = {'a': ['x', 'y'], 'b': ['z'], 'c': ['w']}
+        __propgroup_deps__ = {'b': ['a']}
+        __prop_mappers__ = {}
+
+        @yotter.cache.memoize(timeout=60)
+        def _get_a(self): calls.append(('a', self.id)); return {'x': 1, 'y': 2}
+
+        @yotter.cache.memoize(timeout=60)
+        def _get_b(self): calls.append(('b', self.id)); return {'z': self.x + 1}
+
+        @yotter.cache.memoize(timeout=60)
+        def _get_c(self): gate.wait(5); calls.append(('c', self.id)); return {'w': 4}
+    return Planned, calls, gate
+
+
+def test_plan_chains_groups_after_their_deps(planned):
+    Planned, _, _ = planned
+    assert Planned.plan('z', 'x', 'w').chains == [['a', 'b'], ['c']]
+    with pytest.raises(ValueError): Planned.plan('nope')
+
+
+def test_run_loads_planned_groups(planned):
+    Planned, calls, _ = planned
+    objs = [Planned('1'), Planned('2')]
+    assert Planned.plan('z', 'w').run(*objs, timeout=5) == objs
+    assert sorted(calls) == [('a', '1'), ('a', '2'), ('b', '1'), ('b', '2'), ('c', '1'), ('c', '2')]
+    assert [(o.x, o.y, o.z, o.w) for o in objs] == [(1, 2, 2, 4)] * 2
+
+
+def test_run_loads_groups_with_a_prop_already_set(planned):
+    Planned, calls, _ = planned
+    obj = Planned('1')
+    obj.x = 10  # marks group a loaded, without y
+    Planned.plan('x', 'y').run(obj, timeout=5)
+    assert calls == [('a', '1')]
+    calls.clear()
+    assert obj.y == 2 and calls == []
+
+
+def test_start_returns_before_the_loads(planned):
+    Planned, calls, gate = planned
+    gate.clear()
+    obj, plan = Planned('1'), Planned.plan('w')
+    tasks = plan.start(obj)
+    assert calls == [] and plan.wait(tasks, timeout=0.1) == []
+    gate.set()
+    assert plan.wait(tasks, timeout=5) == [obj] and obj.w == 4
+
+
+def test_prefetch_fans_out(planned):
+    from app.youtubeng import prefetch
+    Planned, calls, gate = planned
+    gate.clear()
+    objs = [Planned(str(i)) for i in range(3)]
+    assert prefetch(objs, ['w'], timeout=0.1) == []  # still loading, in the background
+    gate.set()
+    assert prefetch(objs, ['w', 'x'], timeout=5) == objs
+    assert sorted(calls) == [('a', '0'), ('a', '1'), ('a', '2'), ('c', '0'), ('c', '1'), ('c', '2')]
+
+
+def test_prefetch_leaves_out_failures(planned):
+    from app.youtubeng import prefetch
+    Planned, _, _ = planned
+    objs = [Planned('1'), Planned('2')]
+    objs[1]._get_c = lambda: 1 / 0
+    assert prefetch(objs, ['w'], timeout=5) == objs[:1]
+
+
+@pytest.fixture
+def watch_page(yotter, monkeypatch):
+    '''a video with its oembed loaded; its channel id and watch page are fetched, the page only once `release` is set'''
+    from app import youtubeng
+    video, fetched, release = youtubeng.ytVideo('aaaaaaaaaaa'), [], threading.Event()
+    for k, v in dict(title='The video', thumbnail='https://i.ytimg.com/vi/aaaaaaaaaaa/hqdefault.jpg', channel_name='channel',
+                     channel_url='https://www.youtube.com/channel/UCa').items(): video.setprop(k, v)
+
+    def get_channel_id(url):
+        deadline = time.time() + 1  # gives the page fetch the time to start, if it doesn't wait for this one
+        while 'page' not in fetched and time.time() < deadline: time.sleep(0.01)
+        fetched.append('cid')
+        return 'UCa'
+
+    def extract_info(vid, *args, **kwargs):
+        fetched.append('page')
+        release.wait(5)
+        return {'playability_error': None, 'error': None, 'formats': [], 'title': 'The video', 'author': 'channel', 'author_id': 'UCa',
+                'author_url': 'https://www.youtube.com/channel/UCa', 'thumbnail': 'https://i.ytimg.com/vi/aaaaaaaaaaa/hqdefault.jpg',
+                'time_published': '2026-10-01', 'duration': 60, 'live': False, 'description': '', 'view_count': 10, 'like_count': 5,
+                'dislike_count': 0, 'video_count': None, 'tags': [], 'related_videos': []}
+    monkeypatch.setattr(youtubeng.youtube.channel, 'get_channel_id', get_channel_id, raising=False)
+    monkeypatch.setattr(youtubeng.youtube.watch, 'extract_info', extract_info, raising=False)
+    monkeypatch.setattr(youtubeng.youtube.watch, 'get_subtitle_sources', lambda info: [], raising=False)
+    return video, fetched, release
+
+
+def test_watch_page_loads_while_checking_restrictions(yotter, client, watch_page):
+    video, fetched, release = watch_page
+    release.set()
+    assert 'The video' in client.get('/v/aaaaaaaaaaa').get_data(as_text=True)
+    assert fetched == ['page', 'cid']
+
+
+def test_watch_page_of_a_hidden_video(yotter, client, watch_page):
+    from app.youtubeng import ytChannel
+    video, fetched, release = watch_page
+    ytChannel('UCa').is_blocked = True
+    yotter.db.session.commit()
+    started = time.time()
+    html = client.get('/v/aaaaaaaaaaa').get_data(as_text=True)
+    assert 'Video not found' in html and 'The video' not in html
+    assert time.time() - started < 4 and fetched == ['page', 'cid']  # started, but not waited for
+    release.set()
@@ -0,0 +1,59 @@
+import pytest
+
+
+class FakeRaw(object):
+    def __init__(self, data): self.data, self.reads = data, 0
+
+    def stream(self, size, decode_content=True):
+        assert not decode_content  # relayed as is
+        for i in range(0, len(self.data), size):
+            self.reads += 1
+            yield self.data[i:i + size]
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data, headers):
+        self.status_code, self.raw, self.headers, self.closed = status_code, FakeRaw(data), headers, False
+
+    def close(self): self.closed = True
+
+
+@pytest.fixture
+def upstream(yotter, monkeypatch):
+    '''what the proxy client gets: 3 chunks and a bit of a partial response'''
+    from app import routes
+    upstream = FakeResponse(206, b'x' * (routes.PROXY_CHUNK * 3 + 1), {'Content-Type': 'video/mp4', 'Content-Range': 'bytes 0-196608/1000000',
+                                                                        'Content-Length': '196609', 'Set-Cookie': 'a=b'})
+    upstream.requests = []
+
+    def get(url, stream=False, headers=None):
+        assert stream
+        upstream.requests.append((url, headers))
+        return upstream
+    monkeypatch.setattr(routes.httpclient.proxy, 'get', get)
+    return upstream
+
+
+def test_proxy_response_relays_chunks(yotter, upstream):
+    from app import routes
+    with yotter.app.test_request_context('/stream/x', headers={'Range': 'bytes=0-', 'Cookie': 'session=secret'}):
+        response = routes.proxy_response('https://x.googlevideo.com/videoplayback', 600, **{'Accept-Ranges': 'bytes'})
+    assert upstream.requests == [('https://x.googlevideo.com/videoplayback', {'Range': 'bytes=0-'})]  # no cookies upstream
+    assert response.status_code == 206 and response.content_type == 'video/mp4'
+    assert response.headers['Content-Range'] == 'bytes 0-196608/1000000' and response.headers['Accept-Ranges'] == 'bytes'
+    assert 'Set-Cookie' not in response.headers
+    assert response.cache_control.public and response.cache_control.max_age == 600
+    assert upstream.raw.reads == 0  # nothing read before the client asks for it
+    body = iter(response.response)
+    assert next(body) == b'x' * routes.PROXY_CHUNK and upstream.raw.reads == 1
+    body.close()  # the client went away
+    assert upstream.closed
+
+
+def test_proxy_response_without_range(yotter, upstream):
+    from app import routes
+    upstream.status_code = 200
+    with yotter.app.test_request_context('/ytimg/x'):
+        response = routes.proxy_response('https://i.ytimg.com/vi/x/hqdefault.jpg', 600)
+    assert upstream.requests[0][1] == {} and response.status_code == 200
+    assert b''.join(response.response) == upstream.raw.data and upstream.closed
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+import time
+import pytest
+
+
+@pytest.fixture
+def refresher(yotter, monkeypatch):
+    '''a FeedRefresher that isn't started, and refreshes (synchronously) into `refreshed`'''
+    from app import refresher as module
+    refresher = module.FeedRefresher(yotter.app)
+    refresher.refreshed = []
+    monkeypatch.setattr(module, 'submit', lambda f, *args: f(*args))
+    monkeypatch.setattr(refresher, 'refresh', lambda key: (refresher.refreshed.append(key), refresher.inflight.discard(key)))
+    return refresher
+
+
+def add_user(yotter, name, cids=(), pids=(), last_seen=None):
+    from app.models import User
+    user = User(username=name, last_seen=last_seen or datetime.utcnow())
+    yotter.db.session.add(user)
+    for cid in cids: user.yt_subscribed_channel_ids.add(cid)
+    for pid in pids: user.yt_followed_playlist_ids.add(pid)
+    yotter.db.session.commit()
+    return user
+
+
+def test_subscribed_ids_of_active_users(yotter, refresher):
+    add_user(yotter, 'a', cids=['UCa', 'UCb'], pids=['PLa'])
+    add_user(yotter, 'b', cids=['UCb'])
+    add_user(yotter, 'gone', cids=['UCgone'], last_seen=datetime.utcnow() - timedelta(days=365))
+    assert refresher.subscribed_ids() == {('ytChannel', 'UCa'), ('ytChannel', 'UCb'), ('ytPlaylist', 'PLa')}
+
+
+def test_sync_spreads_feeds_over_their_period(yotter, refresher):
+    from app.refresher import CLASSES
+    add_user(yotter, 'a', cids=['UCa', 'UCb'], pids=['PLa'])
+    refresher.sync()
+    assert refresher.scheduled == refresher.wanted and len(refresher.schedule) == 3
+    for due, cls, _ in refresher.schedule:
+        assert 0 <= due - time.time() <= refresher.period(CLASSES[cls]) + 1
+    refresher.sync()
+    assert len(refresher.schedule) == 3  # scheduled once
+
+
+def test_run_due_refreshes_and_reschedules(yotter, refresher):
+    user = add_user(yotter, 'a', cids=['UCa', 'UCb'])
+    refresher.sync()
+    refresher.schedule = [(0, *key) for _, *key in refresher.schedule]  # all due
+    refresher.run_due()
+    assert sorted(refresher.refreshed) == [('ytChannel', 'UCa'), ('ytChannel', 'UCb')]
+    assert len(refresher.schedule) == 2 and all(due > 0 for due, *_ in refresher.schedule)
+
+    user.yt_subscribed_channel_ids.discard('UCb')
+    yotter.db.session.commit()
+    refresher.sync()
+    refresher.schedule = [(0, *key) for _, *key in refresher.schedule]
+    refresher.refreshed.clear()
+    refresher.run_due()
+    assert refresher.refreshed == [('ytChannel', 'UCa')]  # unsubscribed meanwhile: dropped
+    assert refresher.scheduled == {('ytChannel', 'UCa')}
@@ -0,0 +1,44 @@
+import datetime
+from collections import namedtuple
+import pytest
+
+serialization = pytest.importorskip('app.serialization')  # imports the app, so needs its requirements
+UTC = datetime.timezone.utc
+
+Pair = serialization.register_tuple(namedtuple('Pair', 'a b'))
+
+
+@pytest.fixture(params=['msgpack', 'json'])
+def payloads(request, monkeypatch):
+    if request.param == 'msgpack' and serialization.msgpack is None: pytest.skip('msgpack not installed')
+    if request.param == 'json': monkeypatch.setattr(serialization, 'msgpack', None)
+    return serialization.PayloadSerializer()
+
+
+@pytest.mark.parametrize('value', [
+    None, 1, 1.5, 'x', True, [1, 'a', None], {'a': {'b': [1, 2]}},
+    datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=UTC),
+    datetime.datetime(2020, 1, 2, 3, 4, 5),
+    {'published': datetime.datetime(2021, 6, 1, tzinfo=UTC), 'items': [datetime.datetime(2021, 6, 2)]},
+    (1, 'a', (2, 3)), [(1, 2)], {'t': (1,)},
+    Pair(1, Pair('x', (2,))),
+])
+def test_round_trip(payloads, value):
+    loaded = payloads.loads(payloads.dumps(value))
+    assert loaded == value
+    assert type(loaded) is type(value)
+
+
+@pytest.mark.parametrize('value', [
+    {'$t': 1}, {'$n': 1.0}, {'$o': 'ytVideo', 'id': 'x', 'p': {}}, {'$u': [1]}, {'$r': 'Pair', 'f': [1, 2]},
+    {'$d': {'$t': 1}}, {'x': [{'$t': 'not a timestamp', 'y': 2}]}, {'$s': 1, 'v': 2},
+])
+def test_payload_dicts_with_tag_keys(payloads, value):
+    assert payloads.loads(payloads.dumps(value)) == value
+
+
+def test_unencodable_falls_back_to_pickle(payloads):
+    value = {'s': {1, 2}}
+    data = payloads.dumps(value)
+    assert data[:1] == b'P'
+    assert payloads.loads(data) == value
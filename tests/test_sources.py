@@ -0,0 +1,54 @@
+import time
+import pytest
+
+
+@pytest.fixture
+def youtubeng(yotter):
+    from app import youtubeng
+    return youtubeng
+
+
+def fmt(itag, expire=None, **kwargs):
+    url = f'https://r1.googlevideo.com/videoplayback?itag={itag}' + (f'&expire={expire}' if expire else '')
+    return dict(dict(itag=itag, ext='mp4', url=url, quality=360, height=360, width=640, acodec='mp4a', vcodec='avc1', audio_bitrate=128), **kwargs)
+
+
+def test_url_expiry(youtubeng):
+    now = int(time.time())
+    urls = [fmt(18, now + 21600)['url'], fmt(22, now + 20000)['url'], fmt(140)['url'], '/https://example.com/captions?expire=soon']
+    assert youtubeng.url_expiry(urls) == now + 20000 - youtubeng.SOURCES_EXPIRY_MARGIN
+    assert youtubeng.url_expiry([fmt(140)['url']]) is None
+
+
+def test_sources_are_cached_until_their_urls_expire(youtubeng, monkeypatch):
+    monkeypatch.setitem(youtubeng.prop_mappers, 'map_stream_url', lambda url, vid=None: url)
+    monkeypatch.setattr(youtubeng.youtube.watch, 'get_subtitle_sources', lambda info: [], raising=False)
+    now = int(time.time())
+    info = {'formats': [fmt(18, now + 21600), fmt(140, now + 21600, vcodec=None, quality=None), fmt(0, url=None)]}
+    sources = youtubeng.ytVideo('xxxxxxxxxxx')._make_sources(info)
+    assert [s['src'] for s in sources['av_sources']] == [info['formats'][0]['url']]
+    assert [s['src'] for s in sources['audio_sources']] == [info['formats'][1]['url']]
+    assert sources['sources_expire'] == now + 21600 - youtubeng.SOURCES_EXPIRY_MARGIN
+    assert sources.cache_timeout == pytest.approx(21600 - youtubeng.SOURCES_EXPIRY_MARGIN, abs=2)
+
+    info = {'formats': [fmt(18, now + 60)]}  # almost expired already
+    assert youtubeng.ytVideo('xxxxxxxxxxx')._make_sources(info).cache_timeout == youtubeng.SOURCES_MIN_TTL
+
+
+def test_instances_drop_expired_groups(yotter, youtubeng):
+    calls = []
+
+    @youtubeng.propgroups
+    class Expiring(youtubeng.ytBase):
+        __propgroups__ = {'signed': ['url', 'expires']}
+        __propgroup_expires__ = {'signed': 'expires'}
+        __prop_mappers__ = {}
+
+        @yotter.cache.memoize(timeout=3600)
+        def _get_signed(self):
+            calls.append(self.id)
+            return youtubeng.expiring({'url': f'signed {len(calls)}', 'expires': time.time() + 0.2}, 1)
+    obj = Expiring('1')
+    assert obj.url == 'signed 1' and obj.url == 'signed 1'
+    time.sleep(1.1)  # past the expiry of the instance's props, and of the cached group
+    assert obj.url == 'signed 2' and calls == ['1', '1']
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+
+sqlitecache = pytest.importorskip('app.sqlitecache')  # imports the app, so needs its requirements
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return sqlitecache.SQLiteCache(str(tmp_path / 'cache.sqlite'), max_bytes=2**20, default_timeout=60, key_prefix='t:')
+
+
+def total_size(cache):
+    with cache._conn() as conn: return conn.execute('SELECT SUM(size) FROM cache').fetchone()[0] or 0
+
+
+def test_round_trip(cache):
+    cache.set('a', {'x': [1, 2]})
+    cache.set_many({'b': 'B', 'c': None})
+    assert cache.get('a') == {'x': [1, 2]}
+    assert cache.get_many('b', 'missing', 'a') == ['B', None, {'x': [1, 2]}]
+    assert cache.has('b') and not cache.has('missing')
+    cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_expiry(cache, monkeypatch):
+    cache.set('a', 1, timeout=10)
+    cache.set('forever', 2, timeout=0)
+    now = time.time()
+    monkeypatch.setattr(sqlitecache.time, 'time', lambda: now + 11)
+    assert cache.get('a') is None
+    assert cache.get('forever') == 2
+
+
+def test_add_only_replaces_dead_entries(cache, monkeypatch):
+    assert cache.add('lock', 1, timeout=10)
+    assert not cache.add('lock', 2, timeout=10)
+    assert cache.get('lock') == 1
+    now = time.time()
+    monkeypatch.setattr(sqlitecache.time, 'time', lambda: now + 11)
+    assert cache.add('lock', 3, timeout=10)
+    assert cache.get('lock') == 3
+
+
+def test_add_is_atomic(cache):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.add('lock', 1))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert results.count(True) == 1
+
+
+def test_clear_keeps_other_prefixes(cache, tmp_path):
+    other = sqlitecache.SQLiteCache(cache.path, key_prefix='o:')
+    cache.set('a', 1)
+    other.set('a', 2)
+    cache.clear()
+    assert cache.get('a') is None
+    assert other.get('a') == 2
+
+
+def test_prune_evicts_least_recently_used(cache):
+    cache.max_bytes = 10000
+    blob = 'x' * 1000
+    for i in range(20): cache.set(f'k{i}', blob)
+    with cache._conn() as conn, conn: conn.execute("UPDATE cache SET accessed = 0 WHERE key = 't:k19'")  # the oldest now
+    cache._prune()
+    assert total_size(cache) <= cache.max_bytes
+    assert cache.get('k19') is None
+    assert cache.get('k18') == blob
+
+
+def test_totals_follow_writes(cache):
+    cache.set('a', 'x' * 100)
+    cache.set('a', 'x' * 500)  # replaced
+    cache.set_many({'b': 'y', 'c': 'z' * 50})
+    cache.delete('b')
+    assert cache.stats()['bytes'] == total_size(cache)
+    assert cache.stats()['entries'] == 2
+
+
+def test_prune_schedule():
+    schedule = sqlitecache.PruneSchedule(every=3, interval=3600)
+    assert [schedule.due() for _ in range(6)] == [False, False, True, False, False, True]
+    assert sqlitecache.PruneSchedule(every=100, interval=0).due()
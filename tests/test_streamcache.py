@@ -0,0 +1,85 @@
+import os
+import re
+import pytest
+
+streamcache = pytest.importorskip('app.streamcache')  # imports the app, so needs its requirements
+
+DATA = bytes(range(256)) * 4  # 1024 bytes, in segments of 100
+
+
+class FakeRaw(object):
+    def __init__(self, data): self.data = data
+
+    def stream(self, size, decode_content=False):
+        for i in range(0, len(self.data), size): yield self.data[i:i + size]
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data=b''):
+        self.status_code, self.raw, self.url = status_code, FakeRaw(data), 'https://x.googlevideo.com/videoplayback'
+
+    def close(self): pass
+
+
+class FakeUpstream(object):
+    '''serves byte ranges of DATA'''
+    def __init__(self, status_code=206): self.status_code, self.ranges = status_code, []
+
+    def get(self, url, headers=None, **kwargs):
+        lo, hi = map(int, re.fullmatch(r'bytes=(\d+)-(\d+)', headers['Range']).groups())
+        self.ranges.append((lo, hi))
+        return FakeResponse(self.status_code, DATA[lo:hi + 1])
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(streamcache, 'SEGMENT', 100)
+    monkeypatch.setattr(streamcache, 'CHUNK', 32)
+    upstream = FakeUpstream()
+    monkeypatch.setattr(streamcache.httpclient, 'proxy', upstream)
+    return upstream
+
+
+@pytest.fixture
+def streams(tmp_path):
+    return streamcache.StreamCache(str(tmp_path / 'streams'), max_bytes=2**20)
+
+
+def read(streams, start, end, stream='dQw4w9WgXcQ.18'):
+    return b''.join(streams.stream(stream, 'https://x.googlevideo.com/videoplayback', len(DATA), start, end))
+
+
+@pytest.mark.parametrize('start, end', [(0, 1023), (0, 0), (150, 420), (1000, 1023), (99, 100)])
+def test_ranges(streams, upstream, start, end):
+    assert read(streams, start, end) == DATA[start:end + 1]
+    assert read(streams, start, end) == DATA[start:end + 1]
+
+
+def test_cached_segments_are_not_fetched_again(streams, upstream):
+    read(streams, 150, 250)  # segments 1 and 2
+    assert upstream.ranges == [(100, 299)]
+    assert read(streams, 0, 399) == DATA[:400]
+    assert upstream.ranges[1:] == [(0, 99), (300, 399)]
+    read(streams, 120, 280)
+    assert len(upstream.ranges) == 3
+
+
+def test_upstream_error(streams, upstream):
+    upstream.status_code = 403
+    with pytest.raises(streamcache.StreamFetchError): read(streams, 0, 10)
+    assert streams.stats()['entries'] == 0
+
+
+def test_prune_evicts_least_recently_used(streams, upstream):
+    streams.max_bytes = 300
+    read(streams, 0, 1023)
+    streams._prune()
+    assert streams.stats()['bytes'] <= 300
+    assert len(upstream.ranges) == 1
+    assert read(streams, 0, 1023) == DATA  # the evicted segments are fetched again
+
+
+def test_stream_keys_are_validated(streams):
+    for key in ('../../etc.1', 'abc', 'dQw4w9WgXcQ.18\n', 'a/b.1'):
+        with pytest.raises(ValueError): streams.file(key, 0)
+    assert streams.file('dQw4w9WgXcQ.18', 3).endswith(os.path.join('dQw4w9WgXcQ.18', '3'))
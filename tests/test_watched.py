@@ -0,0 +1,55 @@
+import pytest
+
+
+@pytest.fixture
+def user(yotter):
+    from app.models import User
+    user = User(username='someone')
+    yotter.db.session.add(user)
+    yotter.db.session.commit()
+    return user
+
+
+@pytest.fixture
+def queries(yotter):
+    '''the SELECTs run on the db, as they run'''
+    from sqlalchemy import event
+    queries = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'): queries.append(statement)
+    event.listen(yotter.db.engine, 'before_cursor_execute', record)
+    yield queries
+    event.remove(yotter.db.engine, 'before_cursor_execute', record)
+
+
+def test_watched_progress(yotter, user):
+    user.set_video_watched_progress('v0', 95, 100)
+    user.set_video_watched_progress('v1', 10, 100)
+    user.set_video_watched_progress('v1', 20, 100)  # updated, not added twice
+    assert user.yt_watched_video_ids == {'v0', 'v1'}
+    assert [user.get_video_watched_progress(vid) for vid in ('v0', 'v1', 'v2')] == [95, 20, 0]
+    assert [user.has_watched_video(vid) for vid in ('v0', 'v1', 'v2')] == [True, False, False]
+
+
+def test_prefetch_watched_is_one_query(yotter, user, queries):
+    from app.models import User
+    for i in range(5): user.set_video_watched_progress(f'v{i}', 95, 100)
+    rowid = user.rowid
+    yotter.db.session.remove()
+    user = yotter.db.session.get(User, rowid)  # the next request's user, without an index
+    queries.clear()
+    vids = [f'v{i}' for i in range(10)]
+    user.prefetch_watched(vids)
+    assert len(queries) == 1
+    assert [user.has_watched_video(vid) for vid in vids] == [True] * 5 + [False] * 5
+    assert len(queries) == 1  # answered from the index, unwatched videos included
+
+
+def test_prefetch_watched_in_chunks(yotter, user, queries):
+    user.set_video_watched_progress('v999', 95, 100)
+    user.rowid  # reloaded after the commit
+    queries.clear()
+    user.prefetch_watched(f'v{i}' for i in range(1200))  # more ids than sqlite takes parameters in one query
+    assert len(queries) == 3
+    assert user.has_watched_video('v999') and not user.has_watched_video('v0')